@@ -1,16 +1,35 @@
+import os
 import re
+import copy
+import atexit
+import weakref
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import string
+from collections import Counter
+from itertools import chain, combinations
+import numpy as np
 import pandas as pd
+from importlib.metadata import version as package_version
 from textblob import TextBlob
+from textblob.en import sentiment as textblob_lexicon
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import Pipeline, FunctionTransformer
 from sklearn.preprocessing import StandardScaler
 from sklearn.compose import ColumnTransformer
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer, TfidfTransformer
 from sklearn.decomposition import TruncatedSVD
 from sklearn.multioutput import MultiOutputClassifier
+from joblib import parallel_backend
 from xgboost import XGBClassifier
+import xgboost as xgb
 import spacy
+from text_cache import TextCache
+from tree_ensemble import TreeEnsemble
+from dedup import exact_groups, MinHashDeduplicator
 nlp = spacy.load("en_core_web_sm", disable=["parser", "ner"])
 
 LABEL_COLUMNS =  [
@@ -18,6 +37,46 @@ LABEL_COLUMNS =  [
         "retour_client", "produit_dangereux", "aucun_probleme", "autre_probleme", "sav_saller_probleme"
     ]
 PATH_LABELISED_SET = "Model_elements/final_labeled.csv"   #labelised_set2.csv"
+# nlp.pipe settings for the batched lemmatization (see TextPreprocessor)
+SPACY_BATCH_SIZE = int(os.getenv("SPACY_BATCH_SIZE", 256))
+SPACY_N_PROCESS = int(os.getenv("SPACY_N_PROCESS", 1))
+# sentiment feature: "textblob" (TextBlob polarity) or "fast" (PolarityScorer, vectorized)
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "textblob")
+# predict_and_correct: number of worker processes (1 = serial, -1 = all cores) and rows per chunk
+PREDICT_N_JOBS = int(os.getenv("PREDICT_N_JOBS", 1))
+PREDICT_CHUNK_SIZE = int(os.getenv("PREDICT_CHUNK_SIZE", 500))
+# predict_and_correct: reviews cut to their first MAX_TEXT_CHARS characters before the features
+# (0 = no cap; a cap changes the predictions of the longer reviews)
+MAX_TEXT_CHARS = int(os.getenv("MAX_TEXT_CHARS", 0))
+# upper bounds (characters) of the review length buckets: chunks never mix buckets, timings are per bucket
+LENGTH_BUCKETS = [200, 1000, 5000]
+# create_fitted_pipeline: total number of threads for the nine boosters (-1 = all cores)
+TRAIN_N_JOBS = int(os.getenv("TRAIN_N_JOBS", 1))
+# predict_and_correct: 4-5 star rows only get retour_client predicted (LabelCorrection sets the others)
+RATING_SHORTCUT = os.getenv("RATING_SHORTCUT", "1") == "1"
+# predict_and_correct: each distinct (revue, rating) scored once ("exact"), near-duplicate texts
+# (MinHash similarity >= NEAR_DUP_THRESHOLD, same rating) also reuse a prediction ("near"), or "off"
+DEDUP_MODE = os.getenv("DEDUP_MODE", "exact")
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", 0.9))
+# update_fitted_pipeline: boosting rounds added to each label model with the new labeled rows
+INCREMENTAL_ROUNDS = int(os.getenv("INCREMENTAL_ROUNDS", 20))
+# prediction engine of the loaded models: "xgboost" or "compiled" (CompiledPipeline, same predictions)
+INFERENCE_ENGINE = os.getenv("INFERENCE_ENGINE", "xgboost")
+# "1": TF-IDF + SVD replaced by ProjectedTfidf in the loaded models (same features to float tolerance)
+PROJECTED_TFIDF = os.getenv("PROJECTED_TFIDF", "0") == "1"
+# text features of the trained models: "tfidf" (unbounded vocabulary), "capped" (the TFIDF_MAX_FEATURES
+# most frequent n-grams, float32) or "hashing" (HASHING_N_FEATURES hashed n-grams, no vocabulary, float32)
+TEXT_FEATURES = os.getenv("TEXT_FEATURES", "tfidf")
+TFIDF_MAX_FEATURES = int(os.getenv("TFIDF_MAX_FEATURES", 20000))
+HASHING_N_FEATURES = int(os.getenv("HASHING_N_FEATURES", 2 ** 16))
+# Memo cache of preprocess_text / get_sentiment (see TextCache).
+# To bump whenever normalize_text, the stopwords or lemmatize_doc change: old entries are then ignored.
+PREPROCESS_VERSION = "1"
+TEXT_CACHE_SIZE = int(os.getenv("TEXT_CACHE_SIZE", 100000))
+# SQLite file of the on-disk tier (empty: in-process cache only)
+TEXT_CACHE_PATH = os.getenv("TEXT_CACHE_PATH", "Model_elements/text_cache.sqlite")
+# maximum number of entries of each cache in the SQLite file (the oldest are deleted)
+TEXT_CACHE_DISK_SIZE = int(os.getenv("TEXT_CACHE_DISK_SIZE", 1000000))
 
 # ==== Custom preprocessing classes ====
 class Preprocessor(BaseEstimator, TransformerMixin):
@@ -32,6 +91,23 @@ class Preprocessor(BaseEstimator, TransformerMixin):
         return df[df["revue"] != ". "]
 
 
+class TextPreprocessor(BaseEstimator, TransformerMixin):
+    """Lemmatize the review column with nlp.pipe (batched, optionally multi-process).
+    batch_size / n_process default to SPACY_BATCH_SIZE / SPACY_N_PROCESS at transform time."""
+    def __init__(self, batch_size=None, n_process=None):
+        self.batch_size = batch_size
+        self.n_process = n_process
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, col):
+        texts = preprocess_texts(col,
+                                 batch_size=self.batch_size or SPACY_BATCH_SIZE,
+                                 n_process=self.n_process or SPACY_N_PROCESS)
+        return pd.Series(texts, index=col.index)
+
+
 class LabelCorrection(BaseEstimator, TransformerMixin):
     """Apply correction rules after model prediction."""
     def fit(self, X, y=None):
@@ -49,9 +125,29 @@ class LabelCorrection(BaseEstimator, TransformerMixin):
         df.loc[no_label_mask, "autre_probleme"] = 1
         return df
 
+
+def correct_labels(y, ratings):
+    '''Rules of LabelCorrection on a label matrix, in place.
+    input: label matrix (n_rows, 9) in the order of LABEL_COLUMNS, rating of each row.
+    Output: the corrected matrix'''
+    ratings = np.asarray(ratings)
+    positive = np.isin(ratings, [4, 5])
+    kept = LABEL_COLUMNS.index("retour_client")
+    # 4-5 étoiles : aucun_probleme, et retour_client tel que prédit
+    y[positive] = np.where(np.arange(y.shape[1]) == kept, y[positive], 0)
+    y[positive, LABEL_COLUMNS.index("aucun_probleme")] = 1
+    no_label = ~y.any(axis=1) & np.isin(ratings, [1, 2, 3])
+    y[no_label, LABEL_COLUMNS.index("autre_probleme")] = 1
+    return y
+
 # ==== Feature extraction helpers ====
+def apply_to_column(col, func, args=()):
+    '''Apply func(x, *args) to every value of the column and return a 2D array.
+    Module-level (no lambda) so that fitted pipelines can be pickled.'''
+    return col.apply(lambda x: func(x, *args)).to_numpy().reshape(-1, 1)
+
 def wrap_function(func, *args):
-    return FunctionTransformer(lambda col: col.apply(lambda x: func(x, *args)).to_numpy().reshape(-1, 1), validate=False)
+    return FunctionTransformer(apply_to_column, kw_args={"func": func, "args": args}, validate=False)
 
 pos_voc = ['great', 'love', 'easy', 'soft', 'perfect', 'best',  'happy',
             'amazing', 'beautiful', 'highly', 'ever',  'absolutely', 'loves'
@@ -118,8 +214,7 @@ to_replace = {
     "$":"dollar "
     }
     
-def neg_emojis_counter(texte):
-    emoji_pattern = re.compile(
+neg_emoji_pattern = re.compile(
         "[\U0001F631"  # :cri:
         "\U0001F4A3"  # :bombe:
         "\U0001F621"  # :rage:
@@ -132,10 +227,8 @@ def neg_emojis_counter(texte):
         "\U0001F92E"  # :visage_qui_vomit:
         "]"
     )
-    return len(emoji_pattern.findall(str(texte)))
 
-def pos_emojis_counter(texte):
-    emoji_pattern = re.compile(
+pos_emoji_pattern = re.compile(
         "[\u263A"       # :détendu:
         "\U0001F60A"    # :rougir:
         "\U0001F970"    # :visage_souriant_3_coeurs:
@@ -151,7 +244,12 @@ def pos_emojis_counter(texte):
         "\U0001F496"    # :cœur_scintillant:
         "]"
     )
-    return len(emoji_pattern.findall(str(texte)))
+
+def neg_emojis_counter(texte):
+    return len(neg_emoji_pattern.findall(str(texte)))
+
+def pos_emojis_counter(texte):
+    return len(pos_emoji_pattern.findall(str(texte)))
 
 def regrouped_rating(rating):
     '''allows you to group the notes and smooth out the differences in the notes'''
@@ -168,54 +266,218 @@ def count_trigger(sentence, vocabulary):
     sentence = sentence.lower()
     return sum([int(i in sentence) for i in vocabulary])
 
-def replace_numbers(text):
-    # 1. Remplace les chiffres (ex: 42, 3.14, etc.)
-    text = re.sub(r'\b\d+([.,]\d+)?\b', 'number', text)
+number_words = [
+    'zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+    'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen',
+    'eighteen', 'nineteen', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy',
+    'eighty', 'ninety', 'hundred', 'thousand', 'million', 'billion'
+]
+# Chiffres (ex: 42, 3.14, etc.) et nombres écrits en toutes lettres (anglais, communs)
+DIGITS_REGEX = r'\b\d+([.,]\d+)?\b'
+NUMBER_WORDS_REGEX = r'\b(?:' + '|'.join(number_words) + r')(?:[-\s](?:' + '|'.join(number_words) + r'))*\b'
 
-    # 2. Remplace les nombres écrits en toutes lettres (anglais, communs)
-    number_words = [
-        'zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
-        'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen',
-        'eighteen', 'nineteen', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy',
-        'eighty', 'ninety', 'hundred', 'thousand', 'million', 'billion'
-    ]
 
-    pattern = r'\b(?:' + '|'.join(number_words) + r')(?:[-\s](?:' + '|'.join(number_words) + r'))*\b'
-    text = re.sub(pattern, 'number', text, flags=re.IGNORECASE)
+class TextNormalizer:
+    """Text cleaning applied before spaCy (lowercase, punctuation, emojis, numbers...).
+    Every table and regex is built once; the replacements are one regex pass and
+    numbers and single letters a second one, instead of a replace or re.sub per rule."""
+    def __init__(self, replacements):
+        self.replacements = {"!": " exclam", **replacements}
+        # "!" becomes " exclam" before the other rules in the chained version, so
+        # "no!" then matched " no ": a rule ending with a space also matches with "!"
+        for u, v in replacements.items():
+            if u.endswith(" "):
+                self.replacements[u[:-1] + "!"] = v + "exclam"
+        self.replacements_pattern = re.compile("|".join(map(re.escape, self.replacements)))
+        self.punctuation_table = str.maketrans({p: ' ' for p in string.punctuation})
+        # every alternative starts at a word boundary: the \b(?=...) prefix lets the
+        # regex skip the positions inside words without trying each alternative
+        self.tokens_pattern = re.compile(
+            r'(?=\b[0-9a-zA-Z])(?:'
+            r'(?P<digits>' + DIGITS_REGEX + r')'
+            r'|(?P<words>(?i:' + NUMBER_WORDS_REGEX + r'))'
+            r'|(?P<letter>\b[a-zA-Z]\b)'
+            r')'
+        )
 
-    return text 
-def preprocess_text(text):
-    # Convert to lower  
-    text = text.lower().replace("<br />","").replace("!"," exclam")
-    for u,v in to_replace.items():
-        text = text.replace(u,v)
-    # Remove  punctuation 
-    text = text.translate(str.maketrans({p: ' ' for p in string.punctuation}))
-    # Remove emojis  
-    text = re.sub(r'[^\x00-\x7F]+', '', text) 
-     # Replace digit by "number":
-    text = replace_numbers(text)
-    
-    # Use a regex to remove single letters 
-    text = re.sub(r'\b[a-zA-Z]\b', '', text)
-    # Remove multiple spaces caused by deletion  
-    text = re.sub(r'\s+', ' ', text).strip()
-    # Tokenisation + lemmatisation + stopword removal (sans retirer les négations)
-    doc = nlp(text)
-    stopwords = set(nlp.Defaults.stop_words) - {"not", "no", "nor", "don", "didn", "won", 
-                                                "shouldn","off","can","wasn","only",
-                                                "ain","last","than","first","enough",
-                                               "there","back","breakout",'too'}
+    @staticmethod
+    def _replace_token(match):
+        # single letters are removed, numbers become "number"
+        return '' if match.lastgroup == 'letter' else 'number'
+
+    def normalize(self, text):
+        # "<br />" is removed first: the words it separated can form a replaced expression
+        text = text.lower().replace("<br />", "")
+        text = self.replacements_pattern.sub(lambda m: self.replacements[m.group()], text)
+        # punctuation -> space, then drop non ASCII characters (emojis...)
+        text = text.translate(self.punctuation_table).encode('ascii', 'ignore').decode('ascii')
+        text = self.tokens_pattern.sub(self._replace_token, text)
+        # remove multiple spaces caused by deletion
+        return ' '.join(text.split())
+
+
+normalizer = TextNormalizer(to_replace)
+
+def normalize_text(text):
+    '''Text cleaning applied before spaCy (see TextNormalizer).'''
+    return normalizer.normalize(text)
+
+# Stopwords removed after lemmatisation (sans retirer les négations)
+stopwords = set(nlp.Defaults.stop_words) - {"not", "no", "nor", "don", "didn", "won", 
+                                            "shouldn","off","can","wasn","only",
+                                            "ain","last","than","first","enough",
+                                           "there","back","breakout",'too'}
+
+def lemmatize_doc(doc):
+    '''Keep the lemmas of a spaCy doc that are alphabetic and not stopwords.'''
     tokens = [token.lemma_ for token in doc if token.lemma_ not in stopwords and token.lemma_.isalpha()]
     return ' '.join(tokens)
 
+preprocess_cache = TextCache("preprocess", f"{PREPROCESS_VERSION}-{nlp.meta['name']}-{nlp.meta['version']}",
+                             max_size=TEXT_CACHE_SIZE, path=TEXT_CACHE_PATH, max_disk_size=TEXT_CACHE_DISK_SIZE)
+sentiment_cache = TextCache("sentiment", f"textblob-{package_version('textblob')}",
+                            max_size=TEXT_CACHE_SIZE, path=TEXT_CACHE_PATH, max_disk_size=TEXT_CACHE_DISK_SIZE)
+
+def cache_stats():
+    return {"preprocess": preprocess_cache.stats(), "sentiment": sentiment_cache.stats()}
+
+def reset_cache_stats():
+    preprocess_cache.reset_stats()
+    sentiment_cache.reset_stats()
+
+def add_cache_stats(stats):
+    preprocess_cache.add_stats(stats["preprocess"])
+    sentiment_cache.add_stats(stats["sentiment"])
+
+def _preprocess_text(text):
+    # Tokenisation + lemmatisation + stopword removal
+    return lemmatize_doc(nlp(normalize_text(text)))
+
+def preprocess_text(text):
+    return preprocess_cache.get(text, _preprocess_text)
+
+def _preprocess_texts(texts, batch_size=SPACY_BATCH_SIZE, n_process=SPACY_N_PROCESS):
+    normalized = [normalize_text(text) for text in texts]
+    if n_process < 1:
+        n_process = os.cpu_count()
+    # not worth starting worker processes for a few batches
+    if len(normalized) < batch_size * n_process:
+        n_process = 1
+    docs = nlp.pipe(normalized, batch_size=batch_size, n_process=n_process)
+    return [lemmatize_doc(doc) for doc in docs]
+
+def preprocess_texts(texts, batch_size=SPACY_BATCH_SIZE, n_process=SPACY_N_PROCESS):
+    '''Batched version of preprocess_text: the texts missing from the cache go through nlp.pipe.
+    input: iterable of texts, nlp.pipe batch size and number of processes.
+    Output: list of preprocessed texts (same output as preprocess_text)'''
+    return preprocess_cache.get_many(list(texts),
+                                     lambda missing: _preprocess_texts(missing, batch_size, n_process))
+
+def _get_sentiment(text):
+    return TextBlob(text).sentiment.polarity
+
 def get_sentiment(text):
     '''allows you to obtain a polarity score between -1 and 1 
     (1: the text is very positive, -1: the text is very negative). 
     input: Text. 
     output: Polarity score'''
-    analysis = TextBlob(text)
-    return analysis.sentiment.polarity 
+    return sentiment_cache.get(text, _get_sentiment)
+
+def get_sentiments(texts):
+    '''Batched version of get_sentiment (a single cache lookup for all the texts).'''
+    return sentiment_cache.get_many(list(texts), lambda missing: [_get_sentiment(t) for t in missing])
+
+
+class PolarityScorer:
+    """Vectorized approximation of the TextBlob polarity, using the same lexicon.
+    The lexicon is loaded once into arrays (polarity, intensity, modifier, negation)
+    indexed by word id. A batch of reviews is turned into one flat array of word ids
+    and scored with numpy: a known word preceded by a modifier ("very good") is merged
+    with it and scaled by its intensity, a preceding negation ("not good") gives
+    -0.5 x polarity, a following "!" gives x 1.25, and the polarity is the mean of
+    the assessments of the review.
+    Unlike TextBlob, modifiers and negations only act on the next word (TextBlob keeps
+    them across short words) and emoticons are ignored: see `python benchmarks.py sentiment`
+    for the agreement with TextBlob."""
+    # same tokenization as TextBlob: words are split on spaces and quotes, and the
+    # punctuation around a word is removed (a trailing "!" is kept as a token)
+    quotes_pattern = re.compile("[\'\"‘’“”]")
+    punctuation = ".,;:!?()[]{}`\'\"@#$^&*+-|=~_"
+    negations = ("no", "not", "never")
+    exclamation = "!"
+
+    def __init__(self, lexicon=textblob_lexicon):
+        if dict.__len__(lexicon) == 0:
+            lexicon.load()
+        words = list(lexicon) + [w for w in self.negations + (self.exclamation,) if w not in lexicon]
+        # id 0 = unknown word
+        self.vocabulary = {word: i for i, word in enumerate(words, start=1)}
+        n_words = len(words) + 1
+        self.known = np.zeros(n_words, dtype=bool)
+        self.polarity = np.zeros(n_words)
+        self.intensity = np.ones(n_words)
+        self.is_modifier = np.zeros(n_words, dtype=bool)
+        for word, i in self.vocabulary.items():
+            if word in lexicon:
+                self.known[i] = True
+                self.polarity[i], _, self.intensity[i] = lexicon[word][None]
+                self.is_modifier[i] = "RB" in lexicon[word]
+        self.is_negation = np.zeros(n_words, dtype=bool)
+        self.is_negation[[self.vocabulary[w] for w in self.negations]] = True
+        self.exclamation_id = self.vocabulary[self.exclamation]
+
+    def word_ids(self, text):
+        ids = []
+        for token in self.quotes_pattern.sub(" ", text.lower()).split():
+            word = token.strip(self.punctuation)
+            # unknown one letter words are skipped (TextBlob keeps a negation across them: "not a good")
+            if len(word) > 1 or word in self.vocabulary:
+                ids.append(self.vocabulary.get(word, 0))
+            ids.extend([self.exclamation_id] * (token.count("!") - word.count("!")))
+        return ids
+
+    def score(self, texts):
+        '''input: iterable of texts. Output: array of polarity scores between -1 and 1'''
+        ids = [self.word_ids(text) for text in texts]
+        lengths = np.fromiter((len(review_ids) for review_ids in ids), dtype=np.int64, count=len(ids))
+        words = np.fromiter(chain.from_iterable(ids), dtype=np.int64, count=lengths.sum())
+        review = np.repeat(np.arange(len(ids)), lengths)
+
+        def previous(values, fill=False):
+            # value of the previous word of the same review
+            shifted = np.empty_like(values)
+            shifted[0:1] = fill
+            shifted[1:] = values[:-1]
+            shifted[1:][review[1:] != review[:-1]] = fill
+            return shifted
+
+        def following(values, fill=False):
+            shifted = np.empty_like(values)
+            shifted[-1:] = fill
+            shifted[:-1] = values[1:]
+            shifted[:-1][review[1:] != review[:-1]] = fill
+            return shifted
+
+        known = self.known[words]
+        known_modifier = known & self.is_modifier[words]
+        # "very good": the modifier assessment is replaced by the merged one
+        merged = known & previous(known_modifier)
+        kept = known & ~(known_modifier & following(known))
+        negation = self.is_negation[words]
+        negated = np.where(merged, previous(previous(negation)), previous(negation))
+        # a negated modifier has its intensity inverted ("not very good")
+        previous_intensity = previous(self.intensity[words], fill=1.0)
+        factor = np.where(merged, np.where(negated, 1 / previous_intensity, previous_intensity), 1.0)
+        polarity = np.clip(self.polarity[words] * factor, -1.0, 1.0)
+        polarity = np.where(following(words == self.exclamation_id), np.clip(polarity * 1.25, -1.0, 1.0), polarity)
+        polarity = np.where(negated, -0.5 * polarity, polarity)
+
+        sums = np.bincount(review[kept], weights=polarity[kept], minlength=len(ids))
+        counts = np.bincount(review[kept], minlength=len(ids))
+        return sums / np.maximum(counts, 1)
+
+
+polarity_scorer = PolarityScorer()
 
 def track_trigger(text, list_expr):
     text = text.lower()
@@ -232,6 +494,101 @@ def track_trigger(text, list_expr):
     return total
 
 
+def trie_regex(words):
+    '''Build a regex matching any of the words, written as a prefix tree
+    (one branch per character) so that the regex engine follows a single branch
+    instead of trying every word. When several words start at the same position,
+    the longest one is matched.'''
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return "(?:" + pattern + ")?" if "" in node else pattern
+
+    return build(trie)
+
+
+class TriggerMatcher:
+    """Compute count_trigger on each vocabulary and track_trigger on each expression
+    list in one call, with the same counts.
+    Substrings are searched with a prefix-tree regex tried at every position of the
+    text (overlapping matches, Aho-Corasick style): the longest word found at a position
+    also gives all the shorter words that are a prefix of it. Single words of the
+    expression lists are looked up in a dict while walking the tokens."""
+    def __init__(self, vocabularies, expressions):
+        self.n_vocabularies = len(vocabularies)
+        self.n_features = len(vocabularies) + len(expressions)
+        # count_trigger: each word of the vocabulary found in the lowered text counts once
+        self.vocabulary_matcher = self._build_matcher(enumerate(vocabularies))
+        # track_trigger: each multi word expression found in the cleaned text counts once...
+        self.expression_matcher = self._build_matcher(
+            (self.n_vocabularies + i, [exp for exp in list_expr if len(exp.split(" ")) > 1])
+            for i, list_expr in enumerate(expressions))
+        # ... plus each token of the cleaned text that is in the list
+        self.token_hits = {}
+        for i, list_expr in enumerate(expressions):
+            for token in set(list_expr):
+                self.token_hits.setdefault(token, []).append(self.n_vocabularies + i)
+        self.punctuation_table = str.maketrans({p: ' ' for p in string.punctuation})
+
+    @staticmethod
+    def _build_matcher(lists):
+        '''input: (feature index, word list) pairs.
+        Output: compiled regex, {match: words that are a prefix of the match}
+        and {word: [(feature index, occurrences in the list), ...]}'''
+        word_hits = {}
+        for i, words in lists:
+            for word, n in Counter(words).items():
+                word_hits.setdefault(word, []).append((i, n))
+        if not word_hits:
+            return None, {}, {}
+        regex = re.compile("(?=(" + trie_regex(word_hits) + "))")
+        prefixes = {match: [word for word in word_hits if match.startswith(word)] for match in word_hits}
+        return regex, prefixes, word_hits
+
+    @staticmethod
+    def _add_hits(matcher, text, counts):
+        regex, prefixes, word_hits = matcher
+        if regex is None:
+            return
+        found = set()
+        for match in set(regex.findall(text)):
+            found.update(prefixes[match])
+        for word in found:
+            for i, n in word_hits[word]:
+                counts[i] += n
+
+    def count(self, text):
+        '''input: review text. Output: list of counts (vocabularies then expression lists)'''
+        counts = [0] * self.n_features
+        text = text.lower()
+        self._add_hits(self.vocabulary_matcher, text, counts)
+        text = text.translate(self.punctuation_table)
+        for u, v in to_replace.items():
+            text = text.replace(u, v)
+        self._add_hits(self.expression_matcher, text, counts)
+        for token in text.split():
+            for i in self.token_hits.get(token, ()):
+                counts[i] += 1
+        return counts
+
+
+trigger_matcher = TriggerMatcher([pos_voc, neg_voc],
+                                 [quality_expressions, dammage_expr, side_effect_expr])
+
+def count_triggers(text):
+    '''Output: [pos_trigger, neg_trigger, quality_triger, broken_triger, side_effect_triger]'''
+    return trigger_matcher.count(text)
+
+
 pattern_return_refund = re.compile(
     r'\b('
     r'(return(ed|ing|s|able)?|exchanged)(\s+them|\s+it)?'           # return, returned, returning 
@@ -257,7 +614,9 @@ pattern_non_conformity = re.compile(
     r"\b("
 
     # 1. as described / as pictured / as advertised
-    r"(not|don't|different)?(\w+\s+){0,4}?(as|than|was)\s+(described|pictured|advertised|advertising|photographed|depicted|displayed)"
+    # (the up to 4 words that could precede "as" are not needed to decide if the review matches:
+    # dropping them keeps the same reviews and removes the backtracking on every word)
+    r"(not|don't|different)?(as|than|was)\s+(described|pictured|advertised|advertising|photographed|depicted|displayed)"
     r"|"
 
     # 2. like the picture / like on tv
@@ -299,7 +658,7 @@ pattern_non_conformity = re.compile(
     re.IGNORECASE
 )
 
-pattern_broken_promise = re.compile(
+BROKEN_PROMISE_REGEX = (
     r'\b('
     r"haven't\s+seen\s+too\s+much\s+improvement"
     r'|'
@@ -330,11 +689,20 @@ pattern_broken_promise = re.compile(
     r'works\s+a\s+little'
     r'|'
     r'got\s+any\s+results?'
-    r'|'
-    r'not\s+as\s+\w+(?:\s+\w+)*\s+as\s+(promised|advertised|expected|claimed|pretend)'
-    r')\b',
-    flags=re.IGNORECASE
+    r')\b'
+)
+# not as [words] as promised/advertised...
+# Written as \bnot\s+as\s+\w+(?:\s+\w+)*\s+as\s+(promised|...) this is tried again from every
+# "not as" of a long text and takes quadratic time. If a "not as" matches, the first "not as"
+# of the same run of words and spaces matches too: the regex only starts at the beginning of
+# a run, jumps to its first "not as <word>" (lookahead + backreference = no backtracking),
+# then looks for the ending: each character is read a bounded number of times.
+NOT_AS_PROMISED_REGEX = (
+    r'(?:^|(?<=[^\w\s]))'
+    r'(?=(?P<before_not_as>[\w\s]*?\bnot\s+as\s+\w))(?P=before_not_as)'
+    r'\w*(?:\s+\w+)*?\s+as\s+(promised|advertised|expected|claimed|pretend)\b'
 )
+pattern_broken_promise = re.compile(BROKEN_PROMISE_REGEX + '|' + NOT_AS_PROMISED_REGEX, flags=re.IGNORECASE)
 
 def track_regex(text,pattern):
     text = text.lower().replace("’", "'")
@@ -342,34 +710,143 @@ def track_regex(text,pattern):
         return 1
     else:
         return 0
-    
+
+
+class RegexMatcher:
+    """Evaluate several families of regexes on a review in one scan, with the same
+    results as track_regex on each family (1 if any regex of the family matches).
+    All the regexes are joined into one alternation, one named group per regex. Those
+    starting with \\b (followed by a word character) share a single \\b(?=\\w) prefix.
+    A search returns the leftmost position where a remaining family matches, so no
+    remaining family can match before it: the next search starts from that position
+    with the families not found yet, until all are found or none matches."""
+    def __init__(self, families, flags=re.IGNORECASE):
+        self.family_of = {}
+        regexes = {}
+        for i, family in enumerate(families):
+            for regex in family:
+                name = f"p{len(regexes)}"
+                regexes[name] = regex
+                self.family_of[name] = i
+        # one combined regex per subset of families still to find
+        self.combined = {}
+        for n_remaining in range(1, len(families) + 1):
+            for subset in combinations(range(len(families)), n_remaining):
+                names = [name for name, i in self.family_of.items() if i in subset]
+                word_start = [f"(?P<{name}>{regexes[name][2:]})" for name in names
+                              if regexes[name].startswith(r"\b")]
+                others = [f"(?P<{name}>{regexes[name]})" for name in names
+                          if not regexes[name].startswith(r"\b")]
+                if word_start:
+                    others.insert(0, r"\b(?=\w)(?:" + "|".join(word_start) + ")")
+                self.combined[frozenset(subset)] = re.compile("|".join(others), flags)
+        self.n_families = len(families)
+
+    def search(self, text):
+        '''input: review text. Output: list of 0/1, one per family'''
+        text = text.lower().replace("’", "'")
+        flags = [0] * self.n_families
+        remaining = frozenset(range(self.n_families))
+        pos = 0
+        while remaining:
+            match = self.combined[remaining].search(text, pos)
+            if match is None:
+                break
+            found = self.family_of[match.lastgroup]
+            flags[found] = 1
+            remaining = remaining - {found}
+            pos = match.start()
+        return flags
+
+
+regex_matcher = RegexMatcher([[pattern_return_refund.pattern],
+                              [pattern_non_conformity.pattern],
+                              [BROKEN_PROMISE_REGEX, NOT_AS_PROMISED_REGEX]])
+
+def track_regexes(text):
+    '''Output: [return_trigger, conformity_trigger, claims_trigger]'''
+    return regex_matcher.search(text)
+
+class NumericFeatures(BaseEstimator, TransformerMixin):
+    """Hand-made features of the reviews, computed in a single pass over the rows:
+    neg_emojis, pos_emojis, sentiment, pos_trigger, neg_trigger, return_trigger,
+    quality_triger, broken_triger, side_effect_triger, conformity_trigger,
+    claims_trigger, grouped_rating (same columns and order as the original ColumnTransformer).
+    sentiment: "textblob" (get_sentiment) or "fast" (PolarityScorer on the whole batch).
+    input: DataFrame with the columns revue and rating. Output: float32 array"""
+    feature_names = ["neg_emojis", "pos_emojis", "sentiment", "pos_trigger", "neg_trigger",
+                     "return_trigger", "quality_triger", "broken_triger", "side_effect_triger",
+                     "conformity_trigger", "claims_trigger", "grouped_rating"]
+    # columns of the outputs of count_triggers and track_regexes
+    trigger_columns = [3, 4, 6, 7, 8]
+    regex_columns = [5, 9, 10]
+
+    def __init__(self, sentiment="textblob"):
+        self.sentiment = sentiment
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        return self.compute(X)
+
+    def compute(self, X, columns=None):
+        '''Same as transform, but only the features of the given column indexes are computed
+        (the other columns stay at 0).'''
+        if self.sentiment not in ("textblob", "fast"):
+            raise ValueError(f"Unknown sentiment backend: {self.sentiment}")
+        needed = set(range(len(self.feature_names)) if columns is None else columns)
+        emojis, triggers = bool(needed & {0, 1}), bool(needed & set(self.trigger_columns))
+        regexes, rating_group = bool(needed & set(self.regex_columns)), 11 in needed
+        features = np.zeros((len(X), len(self.feature_names)), dtype=np.float32)
+        if 2 in needed and self.sentiment == "fast":
+            features[:, 2] = polarity_scorer.score(X["revue"])
+        elif 2 in needed:
+            features[:, 2] = get_sentiments(X["revue"])
+        for row, (text, rating) in enumerate(zip(X["revue"], X["rating"])):
+            # emojis are the only non ASCII characters counted
+            if emojis and not text.isascii():
+                features[row, 0] = neg_emojis_counter(text)
+                features[row, 1] = pos_emojis_counter(text)
+            if triggers:
+                features[row, self.trigger_columns] = count_triggers(text)
+            if regexes:
+                features[row, self.regex_columns] = track_regexes(text)
+            if rating_group:
+                features[row, 11] = regrouped_rating(rating)
+        return features
+
+    def get_feature_names_out(self, input_features=None):
+        return np.array(self.feature_names, dtype=object)
+
     #===========Pipeline=============
     
-text_pipeline = Pipeline([
-        ('preprocess', FunctionTransformer(lambda col: col.apply(preprocess_text), validate=False)),
-        ('tfidf', TfidfVectorizer( 
+def build_text_pipeline(text_features=TEXT_FEATURES):
+    '''Text branch of the pipeline: lemmatization, n-gram weighting, SVD (see TEXT_FEATURES).'''
+    if text_features == "tfidf":
+        vectorizer = [('tfidf', TfidfVectorizer( 
             ngram_range=(1, 3),     # unigrams + bigrams+ trigrams
             max_features=None,#,     # ou moins selon ton dataset
             stop_words=None,        # tu as déjà fait le préprocessing
             min_df=2,               # on garde ce qui est fréquent
-            max_df=0.8  )),        # sans être trop fréquent    
-        ('svd', TruncatedSVD(n_components=20))
-    ])
+            max_df=0.8  ))]        # sans être trop fréquent    
+    elif text_features == "capped":
+        # vocabulaire borné : seuls les n-grammes les plus fréquents sont gardés
+        vectorizer = [('tfidf', TfidfVectorizer(ngram_range=(1, 3), max_features=TFIDF_MAX_FEATURES,
+                                                min_df=2, max_df=0.8, dtype=np.float32))]
+    elif text_features == "hashing":
+        # pas de vocabulaire : la mémoire ne dépend pas du nombre de n-grammes vus
+        vectorizer = [('hashing', HashingVectorizer(ngram_range=(1, 3), n_features=HASHING_N_FEATURES,
+                                                    alternate_sign=False, norm=None, dtype=np.float32)),
+                      ('tfidf', TfidfTransformer())]
+    else:
+        raise ValueError(f"Unknown text features: {text_features}")
+    return Pipeline([('preprocess', TextPreprocessor())] + vectorizer
+                    + [('svd', TruncatedSVD(n_components=20, random_state=42))])
 
-numeric_features = ColumnTransformer(transformers=[
-        ('neg_emojis', wrap_function(neg_emojis_counter), 'revue'),
-        ('pos_emojis', wrap_function(pos_emojis_counter), 'revue'),
-        ('sentiment', wrap_function(get_sentiment), 'revue'),
-        ('pos_trigger', wrap_function(count_trigger, pos_voc), 'revue'),
-        ('neg_trigger', wrap_function(count_trigger, neg_voc), 'revue'),
-        ('return_trigger',wrap_function(track_regex,pattern_return_refund), 'revue'),
-        ('quality_triger',wrap_function(track_trigger,quality_expressions), 'revue'),
-        ('broken_triger',wrap_function(track_trigger,dammage_expr), 'revue'),
-        ('side_effect_triger',wrap_function(track_trigger,side_effect_expr), 'revue'),
-        ('conformity_trigger',wrap_function(track_regex,pattern_non_conformity), 'revue'),
-        ('claims_trigger',wrap_function(track_regex,pattern_broken_promise), 'revue'),
-        ('grouped_rating', wrap_function(regrouped_rating), 'rating')
-    ])
+text_pipeline = build_text_pipeline()
+
+numeric_features = NumericFeatures(sentiment=SENTIMENT_BACKEND)
 
 scaled_numeric_pipeline = Pipeline([
         ('features', numeric_features),
@@ -383,6 +860,7 @@ final_features = ColumnTransformer(transformers=[
 
 model = MultiOutputClassifier(XGBClassifier(
             n_jobs=1,
+            tree_method="hist",      # histogrammes : construction des arbres rapide et multi-thread
             use_label_encoder=False,  # pour éviter le warning
             eval_metric='logloss',   # évite erreur pour multiclass
             random_state=42,
@@ -401,19 +879,417 @@ full_pipeline = Pipeline(steps=[
     ])
     
 # ==== Pipeline builder ====
-def create_fitted_pipeline(df_train=None):
-    df_train = df_train or pd.read_csv(PATH_LABELISED_SET,index_col=0)
+def split_thread_budget(n_jobs, n_labels=len(LABEL_COLUMNS)):
+    '''Share n_jobs threads between the label models trained at the same time (outer)
+    and the threads of each booster (inner), without exceeding n_jobs.
+    Output: (outer, inner)'''
+    if n_jobs < 1:
+        n_jobs = os.cpu_count()
+    outer = min(n_jobs, n_labels)
+    return outer, max(1, n_jobs // outer)
+
+def fit_model(model, X, y, n_jobs=TRAIN_N_JOBS):
+    '''Fit the MultiOutputClassifier with n_jobs threads in total:
+    the label boosters are fitted concurrently in threads (XGBoost releases the GIL).
+    The fitted model is set back to one thread for prediction.'''
+    outer, inner = split_thread_budget(n_jobs, y.shape[1])
+    model.set_params(n_jobs=outer, estimator__n_jobs=inner)
+    with parallel_backend("threading", n_jobs=outer):
+        model.fit(X, y)
+    model.set_params(n_jobs=None, estimator__n_jobs=1)
+    for estimator in model.estimators_:
+        estimator.set_params(n_jobs=1)
+    return model
+
+def booster_params(estimator, n_jobs=TRAIN_N_JOBS):
+    '''Parameters of an XGBClassifier for xgb.train.'''
+    params = {k: v for k, v in estimator.get_xgb_params().items() if v is not None}
+    params["nthread"] = n_jobs if n_jobs > 0 else os.cpu_count()
+    return params
+
+def classifier_from_booster(booster, estimator):
+    '''Fitted XGBClassifier (parameters of estimator, one thread) around a booster from xgb.train.'''
+    classifier = XGBClassifier(**estimator.get_params())
+    classifier.load_model(bytearray(booster.save_raw(raw_format="json")))
+    classifier.set_params(n_jobs=1)
+    return classifier
+
+def get_numeric_pipeline(fitted_pipeline):
+    '''Fitted hand-made features + scaler of a full_pipeline (or of a streaming pipeline).'''
+    features = fitted_pipeline.named_steps["features"]
+    if hasattr(features, "numeric_pipeline_"):   # StreamingFeatures
+        return features.numeric_pipeline_
+    return features.named_transformers_["scaled_numeric"]
+
+def update_fitted_pipeline(fitted_pipeline, df_new, n_rounds=INCREMENTAL_ROUNDS, n_jobs=TRAIN_N_JOBS):
+    '''Copy of a fitted pipeline updated with newly labeled rows only: every label booster
+    is trained n_rounds more rounds on them (warm start).
+    The features (text pipeline and scaler) are kept frozen: the split thresholds of the existing
+    trees are in the fitted scale, and rescaling a feature does not change what a tree can split on.
+    n_rounds=0 gives the same predictions as the base pipeline.'''
+    pipeline = copy.deepcopy(fitted_pipeline)
+    df_new = Preprocessor().transform(df_new)
+    X_new = df_new[["revue", "rating"]]
+    X_features = pipeline.named_steps["features"].transform(X_new)
+    model = pipeline.named_steps["model"]
+    params = booster_params(model.estimator, n_jobs)
+    for label, estimator in enumerate(model.estimators_):
+        dtrain = xgb.DMatrix(X_features, label=df_new[LABEL_COLUMNS[label]].to_numpy())
+        booster = xgb.train(params, dtrain, num_boost_round=n_rounds, xgb_model=estimator.get_booster())
+        model.estimators_[label] = classifier_from_booster(booster, model.estimator)
+    return pipeline
+
+def create_fitted_pipeline(df_train=None, n_jobs=TRAIN_N_JOBS, pipeline=full_pipeline):
+    if df_train is None:
+        df_train = pd.read_csv(PATH_LABELISED_SET,index_col=0)
     df_train = Preprocessor().transform(df_train)
     X_train = df_train[["revue", "rating"]]
     y_train = df_train[LABEL_COLUMNS]
-    full_pipeline.fit(X_train, y_train)
-    return full_pipeline
+    X_features = pipeline.named_steps["features"].fit_transform(X_train, y_train)
+    fit_model(pipeline.named_steps["model"], X_features, y_train, n_jobs=n_jobs)
+    return pipeline
+
+class ProjectedTfidf(BaseEstimator, TransformerMixin):
+    """Inference-time replacement of a fitted TfidfVectorizer (l2 norm) + TruncatedSVD.
+    The idf-weighted vocabulary x components projection is computed once; a text is mapped
+    to its SVD vector by summing the projection rows of its n-grams and dividing by the l2
+    norm of its tf-idf weights, without building the sparse TF-IDF matrix.
+    input: column of preprocessed texts. Output: array (n_texts, n_components)"""
+    def __init__(self, vectorizer, svd):
+        self.vectorizer = vectorizer
+        self.svd = svd
+        if vectorizer.norm != "l2" or vectorizer.sublinear_tf or not vectorizer.use_idf:
+            raise ValueError("Only l2-normalized tf-idf without sublinear tf is supported")
+        self.idf_ = vectorizer.idf_
+        self.projection_ = self.idf_[:, None] * svd.components_.T
+        self._token_pattern = re.compile(vectorizer.token_pattern)
+
+    def fit(self, X, y=None):
+        return self
+
+    def _word_ngrams(self, text):
+        '''Same n-grams as the vectorizer's word analyzer (lowercase + token_pattern),
+        built with zip/map instead of a loop per n-gram.'''
+        tokens = self._token_pattern.findall(text.lower() if self.vectorizer.lowercase else text)
+        min_n, max_n = self.vectorizer.ngram_range
+        grams = []
+        for n in range(min_n, max_n + 1):
+            grams.extend(map(" ".join, zip(*(tokens[i:] for i in range(n)))) if n > 1 else tokens)
+        return grams
+
+    def transform(self, col):
+        vectorizer = self.vectorizer
+        if (vectorizer.analyzer == "word" and vectorizer.preprocessor is None and vectorizer.tokenizer is None
+                and vectorizer.stop_words is None and vectorizer.strip_accents is None):
+            analyzer = self._word_ngrams
+        else:
+            analyzer = vectorizer.build_analyzer()
+        vocabulary = vectorizer.vocabulary_.get
+        terms = [[i for i in map(vocabulary, analyzer(text)) if i is not None] for text in col]
+        docs = np.repeat(np.arange(len(terms)), [len(ids) for ids in terms])
+        terms = np.fromiter(chain.from_iterable(terms), dtype=np.int64, count=len(docs))
+        # occurrences regroupées par (texte, n-gramme) : count * idf est le poids tf-idf avant normalisation
+        n_terms = len(self.idf_)
+        pairs, counts = np.unique(docs * n_terms + terms, return_counts=True)
+        pair_docs, pair_terms = pairs // n_terms, pairs % n_terms
+        result = np.zeros((len(col), self.projection_.shape[1]))
+        if len(pairs):
+            starts = np.flatnonzero(np.r_[True, pair_docs[1:] != pair_docs[:-1]])
+            result[pair_docs[starts]] = np.add.reduceat(counts[:, None] * self.projection_[pair_terms], starts)
+        weights = counts * self.idf_[pair_terms]
+        norms = np.sqrt(np.bincount(pair_docs, weights=weights ** 2, minlength=len(col)))
+        return result / np.where(norms > 0, norms, 1)[:, None]
+
+def project_text_features(fitted_pipeline):
+    '''Copy of a fitted full_pipeline whose tfidf + svd steps are replaced by ProjectedTfidf.'''
+    fitted_pipeline = copy.deepcopy(fitted_pipeline)
+    features = fitted_pipeline.named_steps["features"]
+    # les features de l'entraînement en streaming (StreamingFeatures) n'ont pas de ColumnTransformer
+    for i, (name, transformer, columns) in enumerate(getattr(features, "transformers_", [])):
+        # le mode "hashing" n'a pas de vocabulaire à projeter
+        if name == "text_features" and isinstance(transformer.named_steps.get("tfidf"), TfidfVectorizer):
+            projected = Pipeline([
+                ('preprocess', transformer.named_steps["preprocess"]),
+                ('projection', ProjectedTfidf(transformer.named_steps["tfidf"], transformer.named_steps["svd"]))
+            ])
+            features.transformers_[i] = (name, projected, columns)
+    return fitted_pipeline
+
+class CompiledPipeline:
+    """Fitted full_pipeline whose nine boosters are replaced by a single TreeEnsemble:
+    all the labels are scored in one vectorized traversal, with the same predictions."""
+    def __init__(self, fitted_pipeline):
+        self.pipeline = fitted_pipeline
+        self.features = fitted_pipeline.named_steps["features"]
+        self.model = TreeEnsemble.from_multioutput(fitted_pipeline.named_steps["model"])
+
+    def predict(self, X):
+        return self.model.predict(self.features.transform(X))
+
+def get_text_pipeline(fitted_pipeline):
+    '''Fitted text branch (lemmatization ... svd) of a full_pipeline (or of a streaming pipeline).'''
+    features = fitted_pipeline.named_steps["features"]
+    if hasattr(features, "text_pipeline_"):   # StreamingFeatures
+        return features.text_pipeline_
+    return features.named_transformers_["text_features"]
+
+class LabelScorer:
+    """Prediction of a single label of a fitted full_pipeline (or CompiledPipeline), computing
+    only the features its booster splits on: the other columns are left at 0, which does not
+    change the prediction. Used for the rows where LabelCorrection overwrites the other labels."""
+    def __init__(self, fitted_pipeline, label):
+        fitted_pipeline = getattr(fitted_pipeline, "pipeline", fitted_pipeline)
+        self.estimator = fitted_pipeline.named_steps["model"].estimators_[LABEL_COLUMNS.index(label)]
+        used = {int(name[1:]) for name in self.estimator.get_booster().get_score(importance_type="weight")}
+        text_pipeline = get_text_pipeline(fitted_pipeline)
+        numeric = get_numeric_pipeline(fitted_pipeline)
+        # dernière étape : svd, ou projection (project_text_features)
+        if "projection" in text_pipeline.named_steps:
+            self.n_text = text_pipeline.named_steps["projection"].projection_.shape[1]
+        else:
+            self.n_text = text_pipeline.named_steps["svd"].n_components
+        self.n_numeric = len(numeric.named_steps["features"].feature_names)
+        self.text_pipeline = text_pipeline if any(i < self.n_text for i in used) else None
+        self.numeric_features = numeric.named_steps["features"]
+        self.scaler = numeric.named_steps["scaler"]
+        self.numeric_columns = sorted(i - self.n_text for i in used if i >= self.n_text)
+
+    def predict(self, X):
+        features = np.zeros((len(X), self.n_text + self.n_numeric), dtype=np.float32)
+        if self.text_pipeline is not None:
+            features[:, :self.n_text] = self.text_pipeline.transform(X["revue"])
+        if self.numeric_columns:
+            features[:, self.n_text:] = self.scaler.transform(self.numeric_features.compute(X, self.numeric_columns))
+        return self.estimator.predict(features)
+
+# ==== Parallel prediction ====
+# Pipeline of the worker process, set once by _init_worker
+_worker_pipeline = None
+# LabelScorer of each (pipeline, label), built once per process
+_label_scorers = weakref.WeakKeyDictionary()
+
+def fitted_estimators(fitted_pipeline):
+    '''Label boosters of a fitted pipeline (or CompiledPipeline). The list is replaced at each fit,
+    even when create_fitted_pipeline refits the same pipeline object.'''
+    return getattr(fitted_pipeline, "pipeline", fitted_pipeline).named_steps["model"].estimators_
+
+def label_scorer(fitted_pipeline, label):
+    scorers = _label_scorers.setdefault(fitted_pipeline, {})
+    scorer = scorers.get(label)
+    # pipeline réentraîné sur place : le scorer est reconstruit sur le nouveau booster
+    if scorer is None or scorer.estimator is not fitted_estimators(fitted_pipeline)[LABEL_COLUMNS.index(label)]:
+        scorer = scorers[label] = LabelScorer(fitted_pipeline, label)
+    return scorer
+
+def _init_worker(fitted_pipeline):
+    global _worker_pipeline
+    _worker_pipeline = fitted_pipeline
+
+def _predict_chunk(X_chunk, label=None):
+    reset_cache_stats()
+    start = time.perf_counter()
+    scorer = _worker_pipeline if label is None else label_scorer(_worker_pipeline, label)
+    y_pred = scorer.predict(X_chunk)
+    return y_pred, cache_stats(), time.perf_counter() - start
+
+# Pool de process de prédiction, gardé d'un appel à l'autre tant que le pipeline, ses boosters
+# (le pipeline peut être réentraîné sur place) et n_jobs ne changent pas
+_pool = None
+_pool_key = None
+
+def get_pool(fitted_pipeline, n_jobs):
+    '''Pool of n_jobs processes holding fitted_pipeline (sent once, at the start of each process).
+    A new pool is created if fitted_pipeline has been refitted since: the workers hold a copy.'''
+    global _pool, _pool_key
+    estimators = fitted_estimators(fitted_pipeline)
+    if (_pool is not None and _pool_key[0] is fitted_pipeline and _pool_key[1] is estimators
+            and _pool_key[2] == n_jobs):
+        return _pool
+    shutdown_pool()
+    # fork : les workers héritent de spaCy et des caches déjà chargés, mais seulement si aucun autre
+    # thread ne tourne (connexions libpq, verrous de logging ou de queue copiés dans un état
+    # incohérent) ; sinon forkserver, le pipeline étant envoyé par initargs
+    start_methods = multiprocessing.get_all_start_methods()
+    if "fork" in start_methods and threading.active_count() == 1:
+        start_method = "fork"
+    else:
+        start_method = "forkserver" if "forkserver" in start_methods else "spawn"
+    _pool = ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context(start_method),
+                                initializer=_init_worker, initargs=(fitted_pipeline,))
+    _pool_key = (fitted_pipeline, estimators, n_jobs)
+    return _pool
+
+def _noop(_):
+    return None
+
+def start_pool(fitted_pipeline, n_jobs=PREDICT_N_JOBS):
+    '''Create the pool of predict_parallel and start its processes now, e.g. before the process
+    starts other threads, so that they are forked while it is single-threaded.'''
+    if n_jobs < 1:
+        n_jobs = os.cpu_count()
+    if n_jobs <= 1:
+        return None
+    executor = get_pool(fitted_pipeline, n_jobs)
+    list(executor.map(_noop, range(n_jobs)))
+    return executor
+
+def shutdown_pool():
+    global _pool, _pool_key
+    if _pool is not None:
+        _pool.shutdown()
+    _pool, _pool_key = None, None
+
+atexit.register(shutdown_pool)
+
+# Temps de prédiction par tranche de longueur des revues (lignes, morceaux, secondes de calcul)
+_length_timings = {}
+
+def _bucket_name(bucket):
+    bounds = [0] + LENGTH_BUCKETS
+    if bucket == len(LENGTH_BUCKETS):
+        return f">={bounds[-1]}"
+    return f"{bounds[bucket]}-{bounds[bucket + 1]}"
+
+def length_stats():
+    return {name: {**timing, "ms_per_row": round(1000 * timing["seconds"] / timing["rows"], 3)}
+            for name, timing in _length_timings.items()}
+
+def reset_length_stats():
+    _length_timings.clear()
+
+def _add_length_timing(bucket, rows, seconds):
+    timing = _length_timings.setdefault(_bucket_name(bucket), {"rows": 0, "chunks": 0, "seconds": 0.0})
+    timing["rows"] += rows
+    timing["chunks"] += 1
+    timing["seconds"] = round(timing["seconds"] + seconds, 6)
+
+def length_chunks(lengths, max_rows=None, max_chars=None):
+    '''Chunks of rows of similar length, longest first: rows are sorted by decreasing length,
+    and a chunk ends at a bucket boundary, at max_rows rows or at max_chars characters.
+    input: length of each row. Output: list of (bucket, positions of the rows)'''
+    order = np.argsort(-lengths, kind="stable")
+    buckets = np.searchsorted(LENGTH_BUCKETS, lengths[order], side="right")
+    chunks, start, chars = [], 0, 0
+    for i, position in enumerate(order):
+        chars += lengths[position]
+        last = i + 1 == len(order)
+        if (last or buckets[i + 1] != buckets[i] or (max_rows and i + 1 - start >= max_rows)
+                or (max_chars and chars >= max_chars)):
+            chunks.append((buckets[i], order[start:i + 1]))
+            start, chars = i + 1, 0
+    return chunks
+
+def predict_parallel(X_pred, fitted_pipeline, n_jobs=PREDICT_N_JOBS, chunk_size=PREDICT_CHUNK_SIZE, label=None):
+    '''fitted_pipeline.predict (or the LabelScorer of label) on chunks of rows of similar length
+    in a pool of n_jobs processes. A chunk holds about chunk_size rows of average length (fewer long
+    reviews, more short ones), and the longest chunks are sent first so that the workers finish together.
+    The pool is kept between calls with the same pipeline (get_pool): the pipeline is sent once to each
+    worker. The chunks are reassembled in the input order.
+    input: DataFrame with the columns revue and rating. Output: label array'''
+    scorer = fitted_pipeline if label is None else label_scorer(fitted_pipeline, label)
+    if len(X_pred) == 0:
+        return scorer.predict(X_pred)
+    if n_jobs < 1:
+        n_jobs = os.cpu_count()
+    lengths = X_pred["revue"].astype(str).str.len().to_numpy()
+    if n_jobs <= 1 or len(X_pred) <= chunk_size:
+        # en série : un seul morceau par tranche de longueur
+        chunks = length_chunks(lengths)
+        results = []
+        for _, positions in chunks:
+            start = time.perf_counter()
+            results.append((scorer.predict(X_pred.iloc[positions]), None, time.perf_counter() - start))
+    else:
+        chunks = length_chunks(lengths, max_rows=4 * chunk_size, max_chars=chunk_size * max(lengths.mean(), 1))
+        executor = get_pool(fitted_pipeline, n_jobs)
+        try:
+            results = list(executor.map(_predict_chunk, [X_pred.iloc[positions] for _, positions in chunks],
+                                        [label] * len(chunks)))
+        except BrokenProcessPool:
+            # un worker est mort : le pool est recréé au prochain appel
+            shutdown_pool()
+            raise
+    y_pred = None
+    for (bucket, positions), (y_chunk, stats, seconds) in zip(chunks, results):
+        if y_pred is None:
+            y_pred = np.empty((len(X_pred),) + y_chunk.shape[1:], dtype=y_chunk.dtype)
+        y_pred[positions] = y_chunk
+        if stats is not None:
+            add_cache_stats(stats)
+        _add_length_timing(bucket, len(positions), seconds)
+    return y_pred
+
+def _predict_labels(X_pred, fitted_pipeline, n_jobs, chunk_size, rating_shortcut):
+    if not rating_shortcut:
+        return predict_parallel(X_pred, fitted_pipeline, n_jobs=n_jobs, chunk_size=chunk_size)
+    # 4-5 étoiles : LabelCorrection écrase tous les labels sauf retour_client
+    positive = X_pred["rating"].isin([4, 5]).to_numpy()
+    y_pred = np.zeros((len(X_pred), len(LABEL_COLUMNS)), dtype=np.int64)
+    if (~positive).any():
+        y_pred[~positive] = predict_parallel(X_pred[~positive], fitted_pipeline,
+                                             n_jobs=n_jobs, chunk_size=chunk_size)
+    if positive.any():
+        y_pred[positive, LABEL_COLUMNS.index("retour_client")] = predict_parallel(
+            X_pred[positive], fitted_pipeline, n_jobs=n_jobs, chunk_size=chunk_size, label="retour_client")
+    return y_pred
+
+# Compteurs du dédoublonnage (lignes reçues, clés distinctes, lignes réellement prédites)
+_dedup_counts = {"rows": 0, "unique": 0, "scored": 0}
+
+def dedup_stats():
+    rows = _dedup_counts["rows"]
+    return {**_dedup_counts, "dedup_ratio": round(1 - _dedup_counts["scored"] / rows, 3) if rows else None}
+
+def reset_dedup_stats():
+    for key in _dedup_counts:
+        _dedup_counts[key] = 0
+
+def deduplicate(X_pred, mode=DEDUP_MODE, threshold=NEAR_DUP_THRESHOLD):
+    '''Rows to score and, for every input row, the position of the scored row to copy.
+    "exact": same revue and rating, same prediction (features only depend on them).
+    "near": exact keys, then MinHash near-duplicates of the lowercased texts with the same rating
+    (raw texts: emojis, digits and punctuation feed the features). A review whose normalized
+    text is empty (emojis, punctuation only) is never near-merged.'''
+    if mode == "off":
+        # toutes les lignes comptées comme distinctes : statistiques cohérentes d'un mode à l'autre
+        _dedup_counts["unique"] += len(X_pred)
+        return X_pred, np.arange(len(X_pred))
+    if mode not in ("exact", "near"):
+        raise ValueError(f"Unknown dedup mode: {mode}")
+    first_rows, inverse = exact_groups(X_pred)
+    X_unique = X_pred.iloc[first_rows]
+    _dedup_counts["unique"] += len(X_unique)
+    if mode == "exact":
+        return X_unique, inverse
+    texts = X_unique["revue"].tolist()
+    representatives = MinHashDeduplicator(threshold).groups(
+        [text.lower() for text in texts], X_unique["rating"].tolist(),
+        [bool(normalize_text(text)) for text in texts])
+    kept = np.flatnonzero(representatives == np.arange(len(representatives)))
+    return X_unique.iloc[kept], np.searchsorted(kept, representatives)[inverse]
+
+def predict_labels(texts, ratings, fitted_pipeline, n_jobs=PREDICT_N_JOBS, chunk_size=PREDICT_CHUNK_SIZE,
+                   rating_shortcut=RATING_SHORTCUT, dedup=DEDUP_MODE):
+    '''Corrected labels of already cleaned reviews (revue column of Preprocessor), from arrays:
+    the input frame of predict_and_correct is not copied, but a two-column frame (revue, rating)
+    is built for deduplicate and the pipeline; the labels stay a uint8 matrix.
+    input: texts, ratings (sequences of the same length).
+    Output: uint8 matrix (n_rows, 9), columns in the order of LABEL_COLUMNS'''
+    texts = np.asarray(texts, dtype=object)
+    if MAX_TEXT_CHARS:
+        texts = np.array([text[:MAX_TEXT_CHARS] for text in texts], dtype=object)
+    X_pred = pd.DataFrame({"revue": texts, "rating": ratings}, copy=False)
+    X_scored, inverse = deduplicate(X_pred, dedup)
+    _dedup_counts["rows"] += len(X_pred)
+    _dedup_counts["scored"] += len(X_scored)
+    y_pred = _predict_labels(X_scored, fitted_pipeline, n_jobs, chunk_size, rating_shortcut)
+    y_pred = y_pred.astype(np.uint8)[inverse]
+    return correct_labels(y_pred, X_pred["rating"].to_numpy())
 
-def predict_and_correct(df_to_predict, fitted_pipeline):
+def predict_and_correct(df_to_predict, fitted_pipeline, n_jobs=PREDICT_N_JOBS, chunk_size=PREDICT_CHUNK_SIZE,
+                        rating_shortcut=RATING_SHORTCUT, dedup=DEDUP_MODE):
     df_input = Preprocessor().transform(df_to_predict)
-    X_pred = df_input[["revue", "rating"]]
-    y_pred = fitted_pipeline.predict(X_pred)
-    y_pred_df = pd.DataFrame(y_pred, columns=LABEL_COLUMNS, index=df_input.index)
-    result = pd.concat([df_input, y_pred_df], axis=1)
-    corrected = LabelCorrection().transform(result)
-    return corrected
+    y_pred = predict_labels(df_input["revue"].to_numpy(), df_input["rating"].to_numpy(), fitted_pipeline,
+                            n_jobs, chunk_size, rating_shortcut, dedup)
+    y_pred_df = pd.DataFrame(y_pred.astype(np.int64), columns=LABEL_COLUMNS, index=df_input.index)
+    return pd.concat([df_input, y_pred_df], axis=1)
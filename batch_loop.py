@@ -1,20 +1,8 @@
-import time
 import logging
-import subprocess
+from prediction_worker import PredictionWorker
 
 logging.basicConfig(level=logging.INFO)
-n=1
-while True:
-    logging.info(f"⏳ Lancement n°{n} du pipeline via main.py...")
-    
-    result = subprocess.run(["python", "main.py"],  
-                            stdout=subprocess.PIPE,stderr=subprocess.STDOUT,
-                            text=True,
-                )
-    n+=1
-    if "STOP" in result.stdout:
-        logging.info("✅ Plus rien à prédire, on arrête la boucle.")
-        break
 
-    logging.info("🕒 Pause de 3 minutes avant le prochain run.")
-    time.sleep(180)
\ No newline at end of file
+# Un seul process : modèle, spaCy et connexion restent chargés d'un batch à l'autre.
+# Les batchs s'enchaînent sans pause ; la boucle s'arrête quand il n'y a plus rien à prédire.
+PredictionWorker(exit_when_empty=True).run()
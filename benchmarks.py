@@ -0,0 +1,796 @@
+import re
+import sys
+import time
+import random
+import string
+import argparse
+import tempfile
+import io
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.metrics import f1_score
+from sklearn.model_selection import train_test_split
+import joblib
+from sklearn.compose import ColumnTransformer
+import Utils as ut
+from text_cache import TextCache
+import streaming_training
+
+# Scripts de vérification / benchmark des optimisations de Utils.py.
+# Chaque commande compare la version optimisée à l'implémentation de référence
+# (copiée telle quelle depuis l'ancien code) et renvoie un code de sortie 1 en cas d'écart.
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def synthetic_corpus(n_reviews, seed=0):
+    '''Random reviews built from the vocabularies of Utils plus the characters
+    that the cleaning steps handle (punctuation, emojis, digits, <br />...).'''
+    rng = random.Random(seed)
+    atoms = (ut.pos_voc + ut.neg_voc + ut.quality_expressions + ut.dammage_expr
+             + ut.side_effect_expr + ut.number_words + list(ut.to_replace)
+             + ["<br />", "!", "$", "’", "don't", "a", "I", "x", "42", "3.14", "1,5", "Twenty-One",
+                "\U0001F60A", "\U0001F621", "❤", "é", "\t", "\n", "\x00", "  ", "-", "..."])
+    separators = ["", " ", " ", " ", "-", ".", ",", "!", "\n"]
+    return ["".join(rng.choice(atoms) + rng.choice(separators) for _ in range(rng.randint(0, 120)))
+            for _ in range(n_reviews)]
+
+
+# ==== Reference implementations ====
+def reference_replace_numbers(text):
+    text = re.sub(r'\b\d+([.,]\d+)?\b', 'number', text)
+    number_words = [
+        'zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+        'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen',
+        'eighteen', 'nineteen', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy',
+        'eighty', 'ninety', 'hundred', 'thousand', 'million', 'billion'
+    ]
+    pattern = r'\b(?:' + '|'.join(number_words) + r')(?:[-\s](?:' + '|'.join(number_words) + r'))*\b'
+    return re.sub(pattern, 'number', text, flags=re.IGNORECASE)
+
+
+def reference_normalize(text):
+    text = text.lower().replace("<br />", "").replace("!", " exclam")
+    for u, v in ut.to_replace.items():
+        text = text.replace(u, v)
+    text = text.translate(str.maketrans({p: ' ' for p in string.punctuation}))
+    text = re.sub(r'[^\x00-\x7F]+', '', text)
+    text = reference_replace_numbers(text)
+    text = re.sub(r'\b[a-zA-Z]\b', '', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+reference_return_refund = re.compile(
+    r'\b('
+    r'(return(ed|ing|s|able)?|exchanged)(\s+them|\s+it)?'           # return, returned, returning 
+    r'|'
+    r'sent(ing|s)?\s+(this|them\s+|it\s+)?back'                          # sent it back ou sent back
+    r'|'
+    r'send(ing|s)?\s+(this|them\s+|it\s+)?back'                          # send it back ou send back
+    r'|'
+    r'(want|would\s+like|ask|asking)\s+(for\s+)?(a\s+)?refund'  # want/ask for a refund
+    r'|'
+    r'refund(s|ed|ing|able)?'                              # refund, refunded, refunding
+    r'|'
+    r'reimburs(e|ed|ing|able)?'
+    r'|'
+    r'(replaced|repay|money\s+back)'
+    r'|'
+    r'(want|like|get)\s+(a\s+)?replacement'
+    r')\b',
+    flags=re.IGNORECASE
+)
+
+reference_non_conformity = re.compile(
+    r"\b("
+
+    # 1. as described / as pictured / as advertised
+    r"(not|don't|different)?(\w+\s+){0,4}?(as|than|was)\s+(described|pictured|advertised|advertising|photographed|depicted|displayed)"
+    r"|"
+
+    # 2. like the picture / like on tv
+    r"like\s+(on\s+)?(the\s+)?(description|pic|pics|pictures|picture|photo|photos|advertising|tv|pictured|advertised|advertising)"
+    r"|"
+
+    # 3. described as / pictured as
+    r"(described|pictured|advertised|advertising)\s+as"
+    r"|"
+
+    # 4. shown in/on the picture / photo / etc.
+    r"(shown|described|match)\s+(in|on)\s+(the\s+)?(pic|pics|pictures|picture|photo|photos|advertising|tv|pictured|advertised|description)"
+    r"|"
+
+    r"(not|don't)\s(\w+\s+){0,2}?(match|matching)\s+(the\s+)?(pic|pics|pictures|picture|photo|photos|advertising|tv|pictured|advertised|description)"
+    r"|"
+    # 5. misleading / scam
+    r"tampered|fraud|lie(s|d)?|fooled|innacurate|knockoff|cheat(s|ed)?|misleading|Imitation|scam|fake|rip\s+off|ripoff|way\s+off|counterfeit"
+     r"|"
+    # 5. incomplete
+    r"incomplete|not\s+complete|missing"
+    r"|"
+
+    # 6. Not what I expected / Not like I expected
+    r"not\s+(what|like)\s+(i\s+)?expected"
+    r"|"
+
+    # 7. Looks nothing like [photo/etc.]
+    r"looks?\s+nothing\s+like"
+    r"|"
+    r"not\s(as+|the\s+)?(right|good|original|real)\s+(color|size|product|item|fragrance)(s)?"
+    r"|"
+    r"(wrong)\s+(color|size|product|item|fragrance)(s)?"
+    r"|"
+    # 8. Not [optional modifier] as described/pictured/etc.
+    r"not\s+(\w+\s+){0,2}?(like\s+|as\s+)(the\s+)?(description|shown|pic|pics|pictures|picture|photo|photos|advertising|tv|pictured|advertised|description)"
+
+    r")\b",
+    re.IGNORECASE
+)
+
+reference_broken_promise = re.compile(
+    r'\b('
+    r"haven't\s+seen\s+too\s+much\s+improvement"
+    r'|'
+    r'(no\s+)?(any\s+)?(improvement|result(s)?)'
+    r'|'
+    r"(does\s+not|didn't|don't|not)\s+do\s+(what\s+it\s+says|much)"
+    r'|'
+    r'not\s+(do\s+)?what\s+(they|it)\s+(say(s)?|claim(s)?|promise(s)?|pretend(s)?)'
+    r'|'
+    r"claiming\s+that|(didn't|doesn't|does\s+not)\s+work(s)?"
+    r'|'
+    r"(ineffective|useless|(does|did)\s+nothing)|(doesn't|didn't)\s+do\s+anything"
+    r'|'
+    r'not\s+effective'
+    r'|'
+    r"(not|didn't|don't)\s+(notice|see)\s+any\s+(\w+\s+){0,2}?(difference|result|effect(s)?)"
+    r'|'
+    r'contrary\s+to\s+(their|the)\s+(marketing\s+)?claim(s)?'
+    r'|'
+    r'did\s+not\s+address'
+    r'|'
+    r'works\s+slightly'
+    r'|'
+    r'not\s+perform\s+well'
+    r'|'
+    r'zero\s+benefit'
+    r'|'
+    r'works\s+a\s+little'
+    r'|'
+    r'got\s+any\s+results?'
+    r'|'
+    r'not\s+as\s+\w+(?:\s+\w+)*\s+as\s+(promised|advertised|expected|claimed|pretend)'
+    r')\b',
+    flags=re.IGNORECASE
+)
+
+REFERENCE_PATTERNS = [reference_return_refund, reference_non_conformity, reference_broken_promise]
+
+
+# ==== Commands ====
+def check_normalizer(n_reviews):
+    corpus = synthetic_corpus(n_reviews)
+    expected, t_ref = timed(lambda: [reference_normalize(text) for text in corpus])
+    result, t_new = timed(lambda: [ut.normalize_text(text) for text in corpus])
+    print(f"reference      : {t_ref:.3f}s")
+    print(f"normalize_text : {t_new:.3f}s")
+    mismatches = sum(a != b for a, b in zip(expected, result))
+    print(f"{mismatches} différences sur {n_reviews} revues")
+    return mismatches == 0
+
+
+def reference_triggers(text):
+    return [ut.count_trigger(text, ut.pos_voc), ut.count_trigger(text, ut.neg_voc),
+            ut.track_trigger(text, ut.quality_expressions), ut.track_trigger(text, ut.dammage_expr),
+            ut.track_trigger(text, ut.side_effect_expr)]
+
+
+def check_triggers(n_reviews):
+    corpus = synthetic_corpus(n_reviews)
+    expected, t_ref = timed(lambda: [reference_triggers(text) for text in corpus])
+    result, t_new = timed(lambda: [ut.count_triggers(text) for text in corpus])
+    print(f"count_trigger x2 + track_trigger x3 : {t_ref:.3f}s")
+    print(f"count_triggers                      : {t_new:.3f}s")
+    mismatches = sum(a != b for a, b in zip(expected, result))
+    print(f"{mismatches} différences sur {n_reviews} revues")
+    return mismatches == 0
+
+
+def reference_numeric_features():
+    '''The original 12-way ColumnTransformer of the hand-made features.'''
+    return ColumnTransformer(transformers=[
+        ('neg_emojis', ut.wrap_function(ut.neg_emojis_counter), 'revue'),
+        ('pos_emojis', ut.wrap_function(ut.pos_emojis_counter), 'revue'),
+        ('sentiment', ut.wrap_function(ut._get_sentiment), 'revue'),
+        ('pos_trigger', ut.wrap_function(ut.count_trigger, ut.pos_voc), 'revue'),
+        ('neg_trigger', ut.wrap_function(ut.count_trigger, ut.neg_voc), 'revue'),
+        ('return_trigger', ut.wrap_function(ut.track_regex, ut.pattern_return_refund), 'revue'),
+        ('quality_triger', ut.wrap_function(ut.track_trigger, ut.quality_expressions), 'revue'),
+        ('broken_triger', ut.wrap_function(ut.track_trigger, ut.dammage_expr), 'revue'),
+        ('side_effect_triger', ut.wrap_function(ut.track_trigger, ut.side_effect_expr), 'revue'),
+        ('conformity_trigger', ut.wrap_function(ut.track_regex, ut.pattern_non_conformity), 'revue'),
+        ('claims_trigger', ut.wrap_function(ut.track_regex, ut.pattern_broken_promise), 'revue'),
+        ('grouped_rating', ut.wrap_function(ut.regrouped_rating), 'rating')
+    ])
+
+
+def check_numeric(n_reviews):
+    '''NumericFeatures against the original ColumnTransformer: same columns, same order, same values.'''
+    X = ut.Preprocessor().transform(synthetic_frame(n_reviews))[["revue", "rating"]]
+    reference = reference_numeric_features()
+    expected, t_ref = timed(reference.fit_transform, X)
+    disable_text_cache()
+    result, t_new = timed(ut.NumericFeatures(sentiment="textblob").fit_transform, X)
+    print(f"ColumnTransformer : {t_ref:.3f}s")
+    print(f"NumericFeatures   : {t_new:.3f}s")
+    names = [name for name, _, _ in reference.transformers]
+    ok = names == ut.NumericFeatures.feature_names
+    print("colonnes dans le même ordre" if ok else f"ORDRE DIFFÉRENT : {ut.NumericFeatures.feature_names}")
+    mismatches = (expected.astype(np.float32) != result).any(axis=0)
+    for name, mismatch in zip(names, mismatches):
+        if mismatch:
+            print(f"ÉCART sur {name}")
+    return ok and not mismatches.any()
+
+
+def long_reviews(n_reviews, n_words, seed=0):
+    '''Long reviews made of neutral words, with a business expression at the end
+    for one review out of two (worst case: the whole text is scanned).'''
+    rng = random.Random(seed)
+    neutral = ("the this product arrived yesterday and i used it for weeks my skin hair it was "
+               "very really so okay but color smell bottle package box seller would buy again").split()
+    endings = ["", "i returned it", "", "not as described", "", "it didn't work"]
+    return [" ".join(rng.choice(neutral) for _ in range(n_words)) + " " + rng.choice(endings)
+            for _ in range(n_reviews)]
+
+
+def check_regexes(n_reviews, n_words):
+    ok = True
+    for name, corpus in [("corpus synthétique", synthetic_corpus(n_reviews)),
+                         (f"revues de {n_words} mots", long_reviews(n_reviews // 10, n_words))]:
+        expected, t_ref = timed(lambda: [[ut.track_regex(text, p) for p in REFERENCE_PATTERNS] for text in corpus])
+        result, t_new = timed(lambda: [ut.track_regexes(text) for text in corpus])
+        mismatches = sum(a != b for a, b in zip(expected, result))
+        print(f"{name} : track_regex x3 {1e6 * t_ref / len(corpus):.0f} µs/revue, "
+              f"track_regexes {1e6 * t_new / len(corpus):.0f} µs/revue, {mismatches} différences")
+        ok = ok and mismatches == 0
+    return ok
+
+
+# Linéarité des regex métier : le temps à 10x la longueur est comparé au temps mesuré
+# dans le même run (linéaire : ~10x, quadratique : ~100x). Le plafond fixe, très large
+# (~25x le coût réel), n'attrape que les retours arrière catastrophiques.
+MAX_GROWTH = 40
+CEILING_MS_PER_1000_CHARS = 50
+TIMING_REPEATS = 5
+MIN_TIMED_MS = 1  # en dessous, le rapport des temps n'est que du bruit (motif trouvé dès le début)
+
+ADVERSARIAL_UNITS = {
+    "not as repeated": "not as good ",
+    "not as + spaces": "not as " + " " * 30,
+    "not as nested": "not as not as ",
+    "not as + comma": "not as good, ",
+    "words before as": "different word word word ",
+    "not + spaces": "not" + " " * 50,
+    "not match": "don't really really ",
+    "not see any": "didn't see any big ",
+    "returns": "send them ",
+    "copy-paste rant": "this is not what they say it does and it is not as good as ",
+}
+
+
+def dense_reviews(n_reviews, seed=0):
+    '''Short reviews made of the words used by the business regexes, in random order,
+    to compare the rewritten regexes with the reference ones on many near matches.'''
+    rng = random.Random(seed)
+    atoms = ["not", "as", "as", "good", "promised", "advertised", "expected", "cannot", "notas", "was",
+             "than", "different", "don't", "described", "pictured", "like", "the", "picture", "match",
+             "matching", "didn't", "see", "any", "result", "difference", "word", "x"]
+    separators = [" ", " ", " ", "  ", ", ", ". ", "\n", "-", "", "'"]
+    return ["".join(rng.choice(atoms) + rng.choice(separators) for _ in range(rng.randint(1, 25)))
+            for _ in range(n_reviews)]
+
+
+def best_time(func, *args):
+    return min(timed(func, *args)[1] for _ in range(TIMING_REPEATS))
+
+
+def check_regex_budget(n_chars):
+    '''Adversarial reviews (long and repetitive): the time of every pattern must grow linearly
+    with the length of the text, stay under a generous ceiling, and the results must match
+    the reference patterns.'''
+    ok = True
+    patterns = {"return_refund": ut.pattern_return_refund, "non_conformity": ut.pattern_non_conformity,
+                "broken_promise": ut.pattern_broken_promise}
+    for name, unit in ADVERSARIAL_UNITS.items():
+        timings = {}
+        for size in [n_chars // 10, n_chars]:
+            text = unit * (size // len(unit))
+            ceiling = CEILING_MS_PER_1000_CHARS * len(text) / 1e6
+            timings[size] = {pattern_name: best_time(ut.track_regex, text, pattern)
+                             for pattern_name, pattern in patterns.items()}
+            timings[size]["track_regexes"] = best_time(ut.track_regexes, text)
+            for pattern_name, duration in timings[size].items():
+                if duration > ceiling:
+                    ok = False
+                    print(f"DÉPASSEMENT {name} ({len(text)} car.) {pattern_name} : "
+                          f"{1000 * duration:.1f} ms > {1000 * ceiling:.1f} ms")
+        small, large = timings[n_chars // 10], timings[n_chars]
+        growth = {pattern_name: large[pattern_name] / max(small[pattern_name], 1e-6) for pattern_name in large}
+        for pattern_name, ratio in growth.items():
+            if ratio > MAX_GROWTH and large[pattern_name] > MIN_TIMED_MS / 1000:
+                ok = False
+                print(f"NON LINÉAIRE {name} {pattern_name} : x{ratio:.1f} pour une revue 10x plus longue")
+        print(f"{name:<18} {n_chars:>7} car. : max {1000 * max(large.values()):.1f} ms, "
+              f"croissance max x{max(growth.values()):.1f} (seuil x{MAX_GROWTH})")
+    # parité avec les regex de référence (textes courts, où les anciennes regex restent rapides)
+    corpus = dense_reviews(50000) + [unit * 20 for unit in ADVERSARIAL_UNITS.values()]
+    mismatches = sum([ut.track_regex(text, p) for p in REFERENCE_PATTERNS] != ut.track_regexes(text)
+                     for text in corpus)
+    print(f"{mismatches} différences avec les regex de référence sur {len(corpus)} revues")
+    return ok and mismatches == 0
+
+
+def reference_reviews(path, n_reviews):
+    '''Reviews of the labeled set (title + text) if available, else the synthetic corpus.'''
+    try:
+        df = ut.Preprocessor().transform(pd.read_csv(path, index_col=0))
+        return list(df["revue"])
+    except FileNotFoundError:
+        print(f"{path} introuvable : corpus synthétique utilisé")
+        return synthetic_corpus(n_reviews)
+
+
+def check_sentiment(path, n_reviews, min_correlation=0.95):
+    '''Agreement of PolarityScorer with the TextBlob polarity.'''
+    corpus = reference_reviews(path, n_reviews)
+    expected, t_ref = timed(lambda: np.array([ut._get_sentiment(text) for text in corpus]))
+    result, t_new = timed(ut.polarity_scorer.score, corpus)
+    diff = np.abs(expected - result)
+    correlation = np.corrcoef(expected, result)[0, 1]
+    print(f"{len(corpus)} revues")
+    print(f"TextBlob       : {t_ref:.3f}s")
+    print(f"PolarityScorer : {t_new:.3f}s")
+    print(f"corrélation {correlation:.4f}, écart absolu moyen {diff.mean():.4f}, "
+          f"identiques {100 * (diff < 1e-6).mean():.1f}%, même signe {100 * (np.sign(expected) == np.sign(result)).mean():.1f}%")
+    return correlation >= min_correlation
+
+
+def check_cache(path, n_reviews):
+    '''Cold / warm (memory) / warm (SQLite) runs of the cached preprocessing and sentiment,
+    compared to the uncached functions.'''
+    corpus = reference_reviews(path, n_reviews)
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, compute in [("preprocess", ut._preprocess_texts),
+                              ("sentiment", lambda texts: [ut._get_sentiment(t) for t in texts])]:
+            expected, t_ref = timed(compute, corpus)
+            print(f"{name} sans cache : {t_ref:.3f}s")
+            cache = TextCache(name, "bench", path=f"{tmp_dir}/cache.sqlite")
+            for run in ["froid", "mémoire"]:
+                result, t_run = timed(cache.get_many, corpus, compute)
+                print(f"  cache {run:<8}: {t_run:.3f}s {cache.stats()}")
+                ok = ok and result == expected
+                cache.reset_stats()
+            # nouveau process simulé : mémoire vide, lecture du fichier SQLite
+            cache = TextCache(name, "bench", path=f"{tmp_dir}/cache.sqlite")
+            result, t_run = timed(cache.get_many, corpus, compute)
+            print(f"  cache {'disque':<8}: {t_run:.3f}s {cache.stats()}")
+            ok = ok and result == expected
+    print("résultats identiques" if ok else "ÉCART avec les fonctions sans cache")
+    return ok
+
+
+def disable_text_cache():
+    '''Cold runs: no SQLite tier, empty memory tier.'''
+    for cache in (ut.preprocess_cache, ut.sentiment_cache):
+        cache.path = None
+        cache.memory.clear()
+
+
+def synthetic_frame(n_reviews, seed=0):
+    '''Raw frame (title, text, rating) as read from the database.'''
+    rng = random.Random(seed)
+    texts = synthetic_corpus(n_reviews, seed)
+    return pd.DataFrame({"title": ["" if i % 3 else "Review" for i in range(n_reviews)],
+                         "text": texts, "rating": [rng.randint(1, 5) for _ in range(n_reviews)]})
+
+
+def check_predict(path, n_reviews, n_jobs, chunk_size):
+    '''Serial vs process-pool predict_and_correct on the same frame.'''
+    pipeline = ut.create_fitted_pipeline(pd.read_csv(path, index_col=0))
+    df = synthetic_frame(n_reviews)
+    disable_text_cache()
+    expected, t_serial = timed(ut.predict_and_correct, df, pipeline, 1)
+    disable_text_cache()
+    result, t_parallel = timed(ut.predict_and_correct, df, pipeline, n_jobs, chunk_size)
+    print(f"{len(df)} revues")
+    print(f"série            : {t_serial:.3f}s")
+    print(f"parallèle ({n_jobs:>2} j) : {t_parallel:.3f}s")
+    ok = result.equals(expected)
+    print("résultats identiques" if ok else "ÉCART entre série et parallèle")
+    return ok
+
+
+def check_shortcut(path, n_reviews, engine):
+    '''predict_and_correct with and without the rating short-circuit (RATING_SHORTCUT),
+    on the fitted pipeline and on its projected version (project_text_features).'''
+    fitted = ut.create_fitted_pipeline(pd.read_csv(path, index_col=0))
+    df = synthetic_frame(n_reviews)
+    print(f"{len(df)} revues, {100 * df['rating'].isin([4, 5]).mean():.0f}% de 4-5 étoiles")
+    ok = True
+    for name, pipeline in [("tf-idf + svd", fitted), ("tf-idf projeté", ut.project_text_features(fitted))]:
+        if engine == "compiled":
+            pipeline = ut.CompiledPipeline(pipeline)
+        scorer = ut.LabelScorer(pipeline, "retour_client")
+        print(f"{name} - retour_client : features texte {'oui' if scorer.text_pipeline is not None else 'non'}, "
+              f"{len(scorer.numeric_columns)}/{scorer.n_numeric} features numériques")
+        disable_text_cache()
+        expected, t_full = timed(ut.predict_and_correct, df, pipeline, 1, ut.PREDICT_CHUNK_SIZE, False)
+        disable_text_cache()
+        result, t_short = timed(ut.predict_and_correct, df, pipeline, 1, ut.PREDICT_CHUNK_SIZE, True)
+        print(f"  chemin complet : {t_full:.3f}s")
+        print(f"  court-circuit  : {t_short:.3f}s")
+        same = result.equals(expected)
+        print("  résultats identiques" if same else "  ÉCART avec le chemin complet")
+        ok = ok and same
+    return ok
+
+
+def check_dedup(path, n_reviews, duplicate_rate):
+    '''predict_and_correct without dedup, with exact dedup (identical output required) and with
+    near-duplicate dedup (agreement reported, threshold NEAR_DUP_THRESHOLD), on a frame with copied and slightly edited reviews.'''
+    pipeline = ut.create_fitted_pipeline(pd.read_csv(path, index_col=0))
+    rng = random.Random(0)
+    df = synthetic_frame(n_reviews)
+    copies = df.sample(frac=duplicate_rate, replace=True, random_state=0)
+    edited = copies.sample(frac=0.5, random_state=1)
+    edited["text"] = [text + rng.choice([" ", "!", " thanks", "."]) for text in edited["text"]]
+    df = pd.concat([df, copies.drop(edited.index, errors="ignore"), edited], ignore_index=True)
+    results = {}
+    for mode in ["off", "exact", "near"]:
+        disable_text_cache()
+        ut.reset_dedup_stats()
+        results[mode], t_mode = timed(lambda: ut.predict_and_correct(df, pipeline, 1, ut.PREDICT_CHUNK_SIZE,
+                                                                     ut.RATING_SHORTCUT, mode))
+        print(f"{mode:<6}: {t_mode:.3f}s {ut.dedup_stats()}")
+    ok = results["exact"].equals(results["off"])
+    print("exact : résultats identiques" if ok else "exact : ÉCART avec le chemin sans dédoublonnage")
+    agreement = (results["near"][ut.LABEL_COLUMNS] == results["off"][ut.LABEL_COLUMNS]).all(axis=1).mean()
+    print(f"near (seuil {ut.NEAR_DUP_THRESHOLD}) : {100 * agreement:.2f}% de lignes identiques")
+    return ok
+
+
+def check_lengths(path, n_reviews, n_jobs, max_chars):
+    '''predict_and_correct on reviews of mixed lengths: serial and process-pool runs (scheduled by length)
+    must give the same output; time per length bucket, and agreement of a MAX_TEXT_CHARS cap.'''
+    pipeline = ut.create_fitted_pipeline(pd.read_csv(path, index_col=0))
+    df = synthetic_frame(n_reviews)
+    long_rows = df.sample(frac=0.1, random_state=0).index
+    df.loc[long_rows, "text"] = long_reviews(len(long_rows), 1500)
+    results = {}
+    for name, jobs, cap in [("série", 1, 0), (f"parallèle ({n_jobs} j)", n_jobs, 0), (f"cap {max_chars}", 1, max_chars)]:
+        disable_text_cache()
+        ut.reset_length_stats()
+        ut.MAX_TEXT_CHARS = cap
+        results[name], t_run = timed(ut.predict_and_correct, df, pipeline, jobs)
+        print(f"{name} : {t_run:.3f}s")
+        print(pd.DataFrame(ut.length_stats()).T.to_string())
+    ut.MAX_TEXT_CHARS = 0
+    names = list(results)
+    ok = results[names[1]].equals(results[names[0]])
+    print("série / parallèle : résultats identiques" if ok else "ÉCART entre série et parallèle")
+    agreement = (results[names[2]][ut.LABEL_COLUMNS] == results[names[0]][ut.LABEL_COLUMNS]).all(axis=1).mean()
+    print(f"cap {max_chars} caractères : {100 * agreement:.2f}% de lignes identiques")
+    return ok
+
+
+def check_correction(n_rows):
+    '''correct_labels against LabelCorrection on random label matrices and ratings.'''
+    rng = np.random.default_rng(0)
+    y = (rng.random((n_rows, len(ut.LABEL_COLUMNS))) < 0.15).astype(np.uint8)
+    ratings = rng.integers(1, 6, n_rows)
+    df = pd.DataFrame(y.astype(np.int64), columns=ut.LABEL_COLUMNS).assign(rating=ratings)
+    expected, t_frame = timed(ut.LabelCorrection().transform, df)
+    result, t_array = timed(ut.correct_labels, y.copy(), ratings)
+    print(f"{n_rows} lignes")
+    print(f"LabelCorrection : {t_frame:.3f}s")
+    print(f"correct_labels  : {t_array:.3f}s")
+    ok = np.array_equal(result, expected[ut.LABEL_COLUMNS].to_numpy())
+    print("résultats identiques" if ok else "ÉCART avec LabelCorrection")
+    return ok
+
+
+def check_update(path, n_rounds):
+    '''update_fitted_pipeline on 30% of the labeled set: with n_rounds=0 the predictions must be
+    those of the base pipeline; with n_rounds, agreement with the base pipeline is reported.'''
+    df_base, df_new = train_test_split(pd.read_csv(path, index_col=0), test_size=0.3, random_state=42)
+    base = ut.create_fitted_pipeline(df_base)
+    X = ut.Preprocessor().transform(df_new)[["revue", "rating"]]
+    expected = base.predict(X)
+    unchanged = ut.update_fitted_pipeline(base, df_new, n_rounds=0)
+    ok = np.array_equal(unchanged.predict(X), expected)
+    print("n_rounds=0 : prédictions identiques au modèle de base" if ok else "n_rounds=0 : ÉCART avec le modèle de base")
+    updated, t_update = timed(ut.update_fitted_pipeline, base, df_new, n_rounds)
+    agreement = (updated.predict(X) == expected).mean()
+    print(f"n_rounds={n_rounds} : {t_update:.2f}s, {100 * agreement:.2f}% de labels inchangés")
+    return ok
+
+
+def check_train(path, factors, n_jobs):
+    '''Booster training time, one thread vs n_jobs threads, on the features of the labeled set
+    repeated `factor` times (with a small noise so that the rows are not duplicates).'''
+    df_train = ut.Preprocessor().transform(pd.read_csv(path, index_col=0))
+    X_train, y_train = df_train[["revue", "rating"]], df_train[ut.LABEL_COLUMNS]
+    features = ut.full_pipeline.named_steps["features"].fit_transform(X_train, y_train)
+    rng = np.random.default_rng(0)
+    ok = True
+    print(f"threads : {ut.split_thread_budget(n_jobs)} (modèles en parallèle, threads par booster)")
+    for factor in factors:
+        X = np.vstack([features] * factor)
+        X = X + rng.normal(scale=0.01, size=X.shape) * (factor > 1)
+        y = pd.concat([y_train] * factor)
+        serial, t_serial = timed(ut.fit_model, clone(ut.model), X, y, 1)
+        parallel, t_parallel = timed(ut.fit_model, clone(ut.model), X, y, n_jobs)
+        agreement = (serial.predict(X) == parallel.predict(X)).mean()
+        print(f"x{factor:<4} {len(X):>8} lignes : 1 thread {t_serial:.2f}s, {n_jobs} threads {t_parallel:.2f}s "
+              f"(x{t_serial / t_parallel:.1f}), prédictions identiques {100 * agreement:.2f}%")
+        ok = ok and agreement >= 0.99
+    return ok
+
+
+def check_engine(path, batch_sizes, repeats=20):
+    '''TreeEnsemble vs MultiOutputClassifier.predict on the features of the labeled set
+    (with noise to reach the largest batch size): labels and margins must be identical.'''
+    pipeline = ut.create_fitted_pipeline(pd.read_csv(path, index_col=0))
+    model = pipeline.named_steps["model"]
+    ensemble = ut.TreeEnsemble.from_multioutput(model)
+    df = ut.Preprocessor().transform(pd.read_csv(path, index_col=0))
+    features = pipeline.named_steps["features"].transform(df[["revue", "rating"]])
+    rng = np.random.default_rng(0)
+    n_copies = -(-max(batch_sizes) // len(features))
+    X = np.vstack([features + rng.normal(scale=0.5, size=features.shape) * (i > 0) for i in range(n_copies)])
+    mismatches = 0
+    for batch_size in batch_sizes:
+        batch = X[:batch_size]
+        n_runs = max(1, repeats * 100 // batch_size)
+        expected, t_ref = timed(lambda: [model.predict(batch) for _ in range(n_runs)])
+        result, t_new = timed(lambda: [ensemble.predict(batch) for _ in range(n_runs)])
+        mismatches += int((expected[0] != result[0]).sum())
+        print(f"batch {batch_size:>7} : XGBoost {1000 * t_ref / n_runs:9.2f} ms, "
+              f"TreeEnsemble {1000 * t_new / n_runs:9.2f} ms (x{t_ref / t_new:.1f})")
+    expected = np.column_stack([estimator.get_booster().inplace_predict(X.astype(np.float32), predict_type="margin")
+                                for estimator in model.estimators_])
+    margin_mismatches = int((ensemble.predict_margin(X) != expected).sum())
+    print(f"{mismatches} prédictions différentes, {margin_mismatches} marges différentes")
+    return mismatches == 0 and margin_mismatches == 0
+
+
+def check_projection(path, n_reviews, tolerance=1e-9):
+    '''ProjectedTfidf vs tfidf + svd of text_pipeline, on already preprocessed texts.'''
+    df_train = ut.Preprocessor().transform(pd.read_csv(path, index_col=0))
+    text_pipeline = ut.text_pipeline.fit(df_train["revue"])
+    tfidf, svd = text_pipeline.named_steps["tfidf"], text_pipeline.named_steps["svd"]
+    projection = ut.ProjectedTfidf(tfidf, svd)
+    texts = pd.Series(ut.preprocess_texts(list(df_train["revue"]) + synthetic_corpus(n_reviews)))
+    expected, t_ref = timed(lambda: svd.transform(tfidf.transform(texts)))
+    result, t_new = timed(projection.transform, texts)
+    error = np.abs(expected - result).max()
+    print(f"{len(texts)} textes, vocabulaire {len(tfidf.vocabulary_)} n-grammes")
+    print(f"tfidf + svd     : {t_ref:.3f}s")
+    print(f"ProjectedTfidf  : {t_new:.3f}s")
+    print(f"écart maximal {error:.2e}")
+    return error <= tolerance
+
+
+def peak_rss_mb():
+    '''Peak resident set size of the current process (ru_maxrss is in kB on Linux, in bytes on macOS).'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def run_text_features(path, mode):
+    '''One mode of check_text_features, run in a fresh process so that its peak RSS
+    (spaCy and XGBoost native memory included) only covers this mode.'''
+    df = pd.read_csv(path, index_col=0)
+    df_train, df_test = train_test_split(df, test_size=0.2, random_state=42)
+    X_test = ut.Preprocessor().transform(df_test)
+    # lemmatisation faite avant le fit : seule la partie TF-IDF/SVD/modèle est comparée
+    ut.preprocess_texts(ut.Preprocessor().transform(df)["revue"])
+    rss_before = peak_rss_mb()
+    pipeline = clone(ut.full_pipeline).set_params(features__text_features=ut.build_text_pipeline(mode))
+    ut.create_fitted_pipeline(df_train, pipeline=pipeline)
+    rss_fit = peak_rss_mb()
+    buffer = io.BytesIO()
+    joblib.dump(pipeline, buffer)
+    y_pred, t_pred = timed(pipeline.predict, X_test[["revue", "rating"]])
+    report = {"modèle (Mo)": buffer.tell() / 1e6, "RSS avant fit (Mo)": rss_before,
+              "pic RSS fit (Mo)": rss_fit, "prédiction (ms)": 1000 * t_pred}
+    f1 = f1_score(X_test[ut.LABEL_COLUMNS], y_pred, average=None, zero_division=0)
+    return report, f1, len(df_train), len(df_test)
+
+
+def check_text_features(path, modes):
+    '''Report per text featurization mode (see Utils.TEXT_FEATURES): pickled model size,
+    peak RSS of the fit (one fresh process per mode), prediction latency and per-label F1 on a 20% test split.'''
+    report, f1 = {}, {}
+    for mode in modes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            report[mode], f1[mode], n_train, n_test = executor.submit(run_text_features, path, mode).result()
+    print(f"{n_train} revues d'entraînement, {n_test} de test")
+    print("pic RSS : maximum du process depuis son démarrage (imports, spaCy et lemmatisation compris)")
+    print(pd.DataFrame(report).round(2).to_string())
+    f1 = pd.DataFrame(f1, index=ut.LABEL_COLUMNS)
+    f1.loc["moyenne"] = f1.mean()
+    print(f1.round(3).to_string())
+    return True
+
+
+def run_streaming(path, mode, chunk_size):
+    '''One training of check_streaming, run in a fresh process so that its peak RSS
+    (XGBoost DMatrix and spaCy native memory included) only covers this training.'''
+    rss_start = peak_rss_mb()
+    if mode == "streaming":
+        _, t_fit = timed(streaming_training.create_fitted_pipeline_streaming, path, chunk_size)
+    else:
+        _, t_fit = timed(lambda: ut.create_fitted_pipeline(pd.read_csv(path, index_col=0),
+                                                           pipeline=clone(ut.full_pipeline)))
+    return {"RSS au démarrage (Mo)": rss_start, "pic RSS (Mo)": peak_rss_mb(), "fit (s)": t_fit}
+
+
+def check_streaming(path, factors, chunk_size):
+    '''Peak RSS of the in-memory and the streaming training (one fresh process per training,
+    lemmatisation included) on labeled sets `factor` times larger (rows repeated with a synthetic
+    text appended), and its growth from the smallest to the largest set.'''
+    df = pd.read_csv(path, index_col=0)
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for factor in factors:
+            big = pd.concat([df] * factor, ignore_index=True)
+            big["text"] = big["text"].fillna("") + " " + pd.Series(synthetic_corpus(len(big), seed=factor))
+            big["text"] = big["text"].str.replace("\x00", "", regex=False)   # refusé par le module csv avant Python 3.11
+            big_path = f"{tmp_dir}/labeled_x{factor}.csv"
+            big.to_csv(big_path)
+            for mode in ["en mémoire", "streaming"]:
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    report[(f"x{factor}", mode)] = {"lignes": len(big), **executor.submit(
+                        run_streaming, big_path, mode, chunk_size).result()}
+    report = pd.DataFrame(report).T.astype({"lignes": int})
+    print(report.round(2).to_string())
+    smallest, largest = f"x{min(factors)}", f"x{max(factors)}"
+    for mode in ["en mémoire", "streaming"]:
+        peak_small = report.loc[(smallest, mode), "pic RSS (Mo)"]
+        peak_large = report.loc[(largest, mode), "pic RSS (Mo)"]
+        print(f"{mode} : pic RSS {peak_small:.0f} Mo en {smallest}, {peak_large:.0f} Mo en {largest} "
+              f"(x{peak_large / peak_small:.2f})")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vérifications et benchmarks de Utils.py")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    normalizer_parser = subparsers.add_parser("normalizer", help="Parité de TextNormalizer avec l'ancien nettoyage.")
+    normalizer_parser.add_argument("-n", "--n-reviews", type=int, default=100000)
+
+    triggers_parser = subparsers.add_parser("triggers", help="Parité de TriggerMatcher avec count_trigger/track_trigger.")
+    triggers_parser.add_argument("-n", "--n-reviews", type=int, default=100000)
+
+    numeric_parser = subparsers.add_parser("numeric", help="Parité de NumericFeatures avec l'ancien ColumnTransformer.")
+    numeric_parser.add_argument("-n", "--n-reviews", type=int, default=5000)
+
+    regexes_parser = subparsers.add_parser("regexes", help="Parité et latence de RegexMatcher face à track_regex.")
+    regexes_parser.add_argument("-n", "--n-reviews", type=int, default=10000)
+    regexes_parser.add_argument("--n-words", type=int, default=2000, help="longueur des revues longues")
+
+    budget_parser = subparsers.add_parser("regex-budget", help="Temps borné des regex métier sur des revues adverses.")
+    budget_parser.add_argument("--n-chars", type=int, default=100000, help="longueur des plus longues revues")
+
+    sentiment_parser = subparsers.add_parser("sentiment", help="Accord de PolarityScorer avec TextBlob.")
+    sentiment_parser.add_argument("--data", default=ut.PATH_LABELISED_SET)
+    sentiment_parser.add_argument("-n", "--n-reviews", type=int, default=10000,
+                                  help="taille du corpus synthétique si --data est absent")
+
+    cache_parser = subparsers.add_parser("cache", help="Gain et parité du cache de preprocess_text / get_sentiment.")
+    cache_parser.add_argument("--data", default=ut.PATH_LABELISED_SET)
+    cache_parser.add_argument("-n", "--n-reviews", type=int, default=10000,
+                              help="taille du corpus synthétique si --data est absent")
+
+    predict_parser = subparsers.add_parser("predict", help="predict_and_correct en série et en parallèle.")
+    predict_parser.add_argument("--data", default=ut.PATH_LABELISED_SET, help="jeu d'entraînement")
+    predict_parser.add_argument("-n", "--n-reviews", type=int, default=5000)
+    predict_parser.add_argument("-j", "--n-jobs", type=int, default=-1)
+    predict_parser.add_argument("--chunk-size", type=int, default=ut.PREDICT_CHUNK_SIZE)
+
+    train_parser = subparsers.add_parser("train", help="Entraînement des boosters sur 1 thread et en parallèle.")
+    train_parser.add_argument("--data", default=ut.PATH_LABELISED_SET)
+    train_parser.add_argument("--factors", type=int, nargs="+", default=[1, 10, 100],
+                              help="tailles du jeu (multiples du jeu étiqueté)")
+    train_parser.add_argument("-j", "--n-jobs", type=int, default=-1)
+
+    engine_parser = subparsers.add_parser("engine", help="Parité et latence de TreeEnsemble face aux boosters XGBoost.")
+    engine_parser.add_argument("--data", default=ut.PATH_LABELISED_SET)
+    engine_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 100, 5000, 100000])
+
+    projection_parser = subparsers.add_parser("projection", help="Parité et temps de ProjectedTfidf face à tfidf + svd.")
+    projection_parser.add_argument("--data", default=ut.PATH_LABELISED_SET, help="jeu d'entraînement")
+    projection_parser.add_argument("-n", "--n-reviews", type=int, default=5000)
+
+    text_parser = subparsers.add_parser("text-features", help="Taille, mémoire, latence et F1 des modes TEXT_FEATURES.")
+    text_parser.add_argument("--data", default=ut.PATH_LABELISED_SET)
+    text_parser.add_argument("--modes", nargs="+", default=["tfidf", "capped", "hashing"])
+
+    streaming_parser = subparsers.add_parser("streaming", help="Mémoire de l'entraînement en mémoire et en streaming.")
+    streaming_parser.add_argument("--data", default=ut.PATH_LABELISED_SET)
+    streaming_parser.add_argument("--factors", type=int, nargs="+", default=[1, 10])
+    streaming_parser.add_argument("--chunk-size", type=int, default=1000)
+
+    shortcut_parser = subparsers.add_parser("shortcut", help="Parité et gain du court-circuit des 4-5 étoiles.")
+    shortcut_parser.add_argument("--data", default=ut.PATH_LABELISED_SET, help="jeu d'entraînement")
+    shortcut_parser.add_argument("-n", "--n-reviews", type=int, default=5000)
+    shortcut_parser.add_argument("--engine", choices=["xgboost", "compiled"], default="xgboost")
+
+    dedup_parser = subparsers.add_parser("dedup", help="Dédoublonnage exact et approché avant prédiction.")
+    dedup_parser.add_argument("--data", default=ut.PATH_LABELISED_SET, help="jeu d'entraînement")
+    dedup_parser.add_argument("-n", "--n-reviews", type=int, default=3000)
+    dedup_parser.add_argument("--duplicate-rate", type=float, default=0.5)
+
+    lengths_parser = subparsers.add_parser("lengths", help="Ordonnancement par longueur et temps par tranche.")
+    lengths_parser.add_argument("--data", default=ut.PATH_LABELISED_SET, help="jeu d'entraînement")
+    lengths_parser.add_argument("-n", "--n-reviews", type=int, default=3000)
+    lengths_parser.add_argument("-j", "--n-jobs", type=int, default=-1)
+    lengths_parser.add_argument("--max-chars", type=int, default=2000, help="cap comparé au chemin sans cap")
+
+    correction_parser = subparsers.add_parser("correction", help="Parité de correct_labels avec LabelCorrection.")
+    correction_parser.add_argument("-n", "--n-rows", type=int, default=1000000)
+
+    update_parser = subparsers.add_parser("update", help="Mise à jour incrémentale (n_rounds=0 = modèle de base).")
+    update_parser.add_argument("--data", default=ut.PATH_LABELISED_SET)
+    update_parser.add_argument("--rounds", type=int, default=ut.INCREMENTAL_ROUNDS)
+
+    args = parser.parse_args()
+    if args.command == "normalizer":
+        ok = check_normalizer(args.n_reviews)
+    elif args.command == "triggers":
+        ok = check_triggers(args.n_reviews)
+    elif args.command == "numeric":
+        ok = check_numeric(args.n_reviews)
+    elif args.command == "regexes":
+        ok = check_regexes(args.n_reviews, args.n_words)
+    elif args.command == "regex-budget":
+        ok = check_regex_budget(args.n_chars)
+    elif args.command == "sentiment":
+        ok = check_sentiment(args.data, args.n_reviews)
+    elif args.command == "cache":
+        ok = check_cache(args.data, args.n_reviews)
+    elif args.command == "predict":
+        ok = check_predict(args.data, args.n_reviews, args.n_jobs, args.chunk_size)
+    elif args.command == "shortcut":
+        ok = check_shortcut(args.data, args.n_reviews, args.engine)
+    elif args.command == "dedup":
+        ok = check_dedup(args.data, args.n_reviews, args.duplicate_rate)
+    elif args.command == "lengths":
+        ok = check_lengths(args.data, args.n_reviews, args.n_jobs, args.max_chars)
+    elif args.command == "correction":
+        ok = check_correction(args.n_rows)
+    elif args.command == "update":
+        ok = check_update(args.data, args.rounds)
+    elif args.command == "train":
+        ok = check_train(args.data, args.factors, args.n_jobs)
+    elif args.command == "engine":
+        ok = check_engine(args.data, args.batch_sizes)
+    elif args.command == "projection":
+        ok = check_projection(args.data, args.n_reviews)
+    elif args.command == "text-features":
+        ok = check_text_features(args.data, args.modes)
+    elif args.command == "streaming":
+        ok = check_streaming(args.data, args.factors, args.chunk_size)
+    sys.exit(0 if ok else 1)
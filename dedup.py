@@ -0,0 +1,65 @@
+import zlib
+import numpy as np
+
+# MinHash : hachage universel (a * h + b) mod MERSENNE_PRIME sur des shingles hachés en 31 bits
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+def exact_groups(X):
+    '''Rows with the same revue and rating (the whole input of the features) share a key.
+    input: DataFrame with the columns revue and rating.
+    Output: (index of the first row of each key, key number of every row)'''
+    # Dictionnaire Python plutôt que pd.factorize : en pandas < 2, les chaînes objet sont hachées
+    # comme des chaînes C, tronquées au premier "\x00" (textes différents fusionnés)
+    keys = {}
+    codes = np.fromiter((keys.setdefault(key, len(keys)) for key in zip(X["revue"], X["rating"])),
+                        dtype=np.intp, count=len(X))
+    _, first_rows = np.unique(codes, return_index=True)
+    return first_rows, codes
+
+
+class MinHashDeduplicator:
+    """Near-duplicate detection with MinHash + LSH.
+    The signature of a text is the minimum of num_perm hash functions over its word shingles;
+    texts sharing a band of rows_per_band values (and the same rating) are candidates,
+    kept as duplicates if their estimated Jaccard similarity is >= threshold."""
+    def __init__(self, threshold=0.9, num_perm=64, rows_per_band=4, shingle_size=3, seed=42):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.rows_per_band = rows_per_band
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, tokens):
+        n = self.shingle_size
+        shingles = {" ".join(tokens[i:i + n]) for i in range(max(1, len(tokens) - n + 1))}
+        hashes = np.array([zlib.crc32(s.encode("utf-8")) & MERSENNE_PRIME for s in shingles], dtype=np.uint64)
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % MERSENNE_PRIME).min(axis=1)
+
+    def groups(self, texts, ratings, mergeable=None):
+        '''input: texts, ratings, and optionally a flag per row: rows not mergeable are never
+        grouped with another one.
+        Output: representative row of every row (itself if it has no near-duplicate before it)'''
+        signatures = [self.signature(text.split()) for text in texts]
+        representatives = np.arange(len(signatures))
+        if mergeable is None:
+            mergeable = [True] * len(signatures)
+        buckets = {}
+        n_bands = self.num_perm // self.rows_per_band
+        for i, (signature, rating, can_merge) in enumerate(zip(signatures, ratings, mergeable)):
+            if not can_merge:
+                continue
+            keys = [(band, rating, signature[band * self.rows_per_band:(band + 1) * self.rows_per_band].tobytes())
+                    for band in range(n_bands)]
+            candidates = sorted({j for key in keys for j in buckets.get(key, ())})
+            match = next((j for j in candidates
+                          if (signatures[j] == signature).mean() >= self.threshold), None)
+            if match is not None:
+                representatives[i] = match
+            else:
+                # seuls les représentants sont indexés : pas de chaînes de quasi-doublons
+                for key in keys:
+                    buckets.setdefault(key, []).append(i)
+        return representatives
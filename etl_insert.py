@@ -1,4 +1,6 @@
 import os
+import io
+import time
 import pandas as pd
 import psycopg2
 import logging
@@ -34,42 +36,61 @@ logger.addHandler(file_handler)
 # === Exemple d'utilisation ===
 logger.info("Démarrage de ETL.")
 
-def insert_predictions(df, conn):
+def insert_predictions(df, conn, close_connection=True, claimed_by=None):
+    '''Write the predictions of df (indexed by id) in SUPABASE_TABLE.
+    close_connection=False keeps conn open for the next batch (long-lived worker).
+    claimed_by: only the rows still claimed by this worker are written (lease not taken over).
+    Output: number of rows updated (0 on error)'''
     try:
         #df = pd.read_csv(filepath, index_col="id")
 
         if df.empty:
-            logging.info("Aucune donnée à insérer.")
-            return
+            logger.info("Aucune donnée à insérer.")
+            return 0
 
         df["has_prediction"] = True
         df["predicted_at"] = datetime.utcnow()
+        start = time.perf_counter()
 
-        update_values = [
-            (
-                row["has_prediction"],
-                row["predicted_at"],
-                *[row[col] for col in CLASSES],
-                idx
-            )
-            for idx, row in df.iterrows()
-        ]
-
-        query = f'''
-            UPDATE {SUPABASE_TABLE}
-            SET has_prediction = %s,
-                predicted_at = %s,
-                {', '.join([f"{col} = %s" for col in CLASSES])}
-            WHERE id = %s;
-        '''
+        # COPY du batch dans une table temporaire (mêmes types que la table), puis un seul UPDATE ... FROM :
+        # un aller-retour pour tout le batch au lieu d'un UPDATE par ligne
+        columns = ["id", "predicted_at", "model_version", *CLASSES]
+        buffer = io.StringIO()
+        df.rename_axis("id").reset_index()[columns].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        claim_filter = " AND t.claimed_by = %s" if claimed_by is not None else ""
 
         cursor = conn.cursor()
-        cursor.executemany(query, update_values)
+        cursor.execute(f'''
+            CREATE TEMP TABLE predictions_tmp ON COMMIT DROP AS
+            SELECT {', '.join(columns)} FROM {SUPABASE_TABLE} WITH NO DATA;
+        ''')
+        cursor.copy_expert(f"COPY predictions_tmp ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(f'''
+            UPDATE {SUPABASE_TABLE} AS t
+            SET has_prediction = TRUE,
+                predicted_at = s.predicted_at,
+                model_version = s.model_version,
+                {', '.join([f"{col} = s.{col}" for col in CLASSES])}
+            FROM predictions_tmp AS s
+            WHERE t.id = s.id{claim_filter};
+        ''', (claimed_by,) if claimed_by is not None else None)
+        updated = cursor.rowcount
         conn.commit()
         cursor.close()
-
-        logger.info(f"Mise à jour réussie de {len(update_values)} lignes.")
+        elapsed = time.perf_counter() - start
+
+        if updated < len(df) and claimed_by is not None:
+            logger.info(f"{len(df) - updated} lignes ignorées (bail repris par un autre worker).")
+        elif updated < len(df):
+            logger.info(f"{len(df) - updated} lignes non trouvées dans {SUPABASE_TABLE}.")
+        logger.info(f"Mise à jour réussie de {updated} lignes en {elapsed:.2f}s ({updated / elapsed:.0f} lignes/s).")
+        return updated
     except Exception as e:
         logger.error(f"Erreur lors de l'insertion des prédictions : {e}")
+        if not conn.closed:
+            conn.rollback()
+        return 0
     finally:
-        conn.close()
+        if close_connection:
+            conn.close()
@@ -2,7 +2,7 @@ import os
 import logging
 from dotenv import load_dotenv
 import psycopg2
-from predict_batch import get_prediction
+from predict_batch import get_prediction, release_claims, default_worker_id
 from etl_insert import insert_predictions
 from datetime import datetime
 
@@ -53,12 +53,18 @@ except Exception as e:
     exit()
 
 # === Pipeline ===
-df_preds = get_prediction()
+# lignes réservées sous cet identifiant : jamais lues ni écrasées par un autre worker
+worker_id = default_worker_id()
+df_preds = get_prediction(worker_id=worker_id)
 
 if df_preds is None:
     logger.info("Aucune donnée à prédire. Fin du pipeline.")
     print("STOP", flush=True)
     exit()
 logger.info(f"{len(df_preds)} ,lignes(main)")
-insert_predictions(df_preds, conn)
+written = insert_predictions(df_preds, conn, close_connection=False, claimed_by=worker_id)
+if not written:
+    # rien d'écrit : les lignes sont rendues sans attendre l'expiration du bail
+    release_claims(conn, worker_id, df_preds.index)
+conn.close()
 logger.info("🎯 Pipeline complet exécuté avec succès.")
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+import joblib
+import pandas as pd
+import sklearn
+import xgboost
+from sklearn.base import clone
+from sklearn.metrics import f1_score
+from sklearn.model_selection import train_test_split
+from Utils import (create_fitted_pipeline, update_fitted_pipeline, project_text_features, CompiledPipeline,
+                   Preprocessor, full_pipeline, LABEL_COLUMNS, PATH_LABELISED_SET, INCREMENTAL_ROUNDS,
+                   INFERENCE_ENGINE, PROJECTED_TFIDF)
+from streaming_training import create_fitted_pipeline_streaming, TRAIN_CHUNK_SIZE
+
+# Dossier des modèles entraînés : un sous-dossier par version,
+# et un fichier ACTIVE qui contient le nom de la version utilisée en prédiction.
+MODELS_DIR = os.getenv("MODELS_DIR", "Model_elements/models")
+ACTIVE_FILE = "ACTIVE"
+PIPELINE_FILE = "full_pipeline.joblib"
+METADATA_FILE = "metadata.json"
+
+logger = logging.getLogger("model_registry")
+
+# Cache en mémoire : {(version, moteur, tf-idf projeté): pipeline} pour ne charger l'artefact qu'une fois par process.
+# Seul le dernier pipeline chargé est gardé : un worker qui change de version active libère l'ancien modèle.
+_loaded_pipelines = {}
+
+
+def new_version():
+    # microsecondes : deux entraînements ou mises à jour peuvent se terminer dans la même seconde
+    return datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
+
+
+def get_active_version():
+    '''Return the version used for prediction.
+    The MODEL_VERSION environment variable takes precedence over the ACTIVE file.'''
+    version = os.getenv("MODEL_VERSION")
+    if version:
+        return version
+    active_path = os.path.join(MODELS_DIR, ACTIVE_FILE)
+    if not os.path.exists(active_path):
+        return None
+    with open(active_path) as f:
+        return f.read().strip() or None
+
+
+def set_active_version(version):
+    if not os.path.exists(os.path.join(MODELS_DIR, version, PIPELINE_FILE)):
+        raise FileNotFoundError(f"Aucun modèle pour la version {version} dans {MODELS_DIR}")
+    tmp_path = os.path.join(MODELS_DIR, ACTIVE_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    # remplacement atomique : un worker ne lit jamais un fichier ACTIVE à moitié écrit
+    os.replace(tmp_path, os.path.join(MODELS_DIR, ACTIVE_FILE))
+    logger.info(f"Version active : {version}")
+
+
+def list_versions():
+    if not os.path.isdir(MODELS_DIR):
+        return []
+    return sorted(v for v in os.listdir(MODELS_DIR)
+                  if os.path.exists(os.path.join(MODELS_DIR, v, PIPELINE_FILE)))
+
+
+def get_metadata(version):
+    with open(os.path.join(MODELS_DIR, version, METADATA_FILE)) as f:
+        return json.load(f)
+
+
+def save_pipeline(pipeline, version=None, metadata=None, activate=True):
+    '''Write a fitted pipeline as a new version of the registry.
+    input: fitted pipeline, optional version name and metadata dict.
+    output: version name'''
+    version = version or new_version()
+    version_dir = os.path.join(MODELS_DIR, version)
+    os.makedirs(version_dir, exist_ok=False)
+    joblib.dump(pipeline, os.path.join(version_dir, PIPELINE_FILE))
+    metadata = {
+        "version": version,
+        "created_at": datetime.utcnow().isoformat(),
+        "sklearn_version": sklearn.__version__,
+        "xgboost_version": xgboost.__version__,
+        **(metadata or {}),
+    }
+    with open(os.path.join(version_dir, METADATA_FILE), "w") as f:
+        json.dump(metadata, f, indent=2)
+    logger.info(f"Modèle enregistré : {version_dir}")
+    if activate:
+        set_active_version(version)
+    return version
+
+
+def train_and_register(path=PATH_LABELISED_SET, activate=True, streaming=False, chunk_size=None):
+    '''Fit full_pipeline on the labeled set and save it as a new version.
+    streaming: out-of-core training, the labeled set is read by chunks (see streaming_training).'''
+    if streaming:
+        pipeline = create_fitted_pipeline_streaming(path, chunk_size or TRAIN_CHUNK_SIZE)
+        return save_pipeline(pipeline, activate=activate,
+                             metadata={"train_path": path, "streaming": True,
+                                       "n_train_rows": int(pipeline.named_steps["features"].n_documents_)})
+    df_train = pd.read_csv(path, index_col=0)
+    pipeline = create_fitted_pipeline(df_train)
+    return save_pipeline(pipeline, activate=activate,
+                         metadata={"train_path": path, "n_train_rows": len(df_train)})
+
+
+def per_label_f1(pipeline, df_eval):
+    df_eval = Preprocessor().transform(df_eval)
+    y_pred = pipeline.predict(df_eval[["revue", "rating"]])
+    return pd.Series(f1_score(df_eval[LABEL_COLUMNS], y_pred, average=None, zero_division=0), index=LABEL_COLUMNS)
+
+
+def update_and_register(new_path, base_version=None, n_rounds=INCREMENTAL_ROUNDS, activate=True,
+                        compare_with=None, eval_path=None):
+    '''Update a version (the active one by default) with newly labeled rows only
+    (see update_fitted_pipeline) and save it as a new version.
+    compare_with: labeled set of the base version; a full retrain on it + the new rows is
+    then timed and compared (per-label F1) on eval_path. Without eval_path, 20% of the new rows
+    are held out and both compared models are fitted on the other 80%; the saved version is
+    always updated with all the new rows.'''
+    base_version = base_version or get_active_version()
+    base_pipeline = joblib.load(os.path.join(MODELS_DIR, base_version, PIPELINE_FILE))
+    df_new = pd.read_csv(new_path, index_col=0)
+
+    start = time.perf_counter()
+    pipeline = update_fitted_pipeline(base_pipeline, df_new, n_rounds=n_rounds)
+    update_seconds = time.perf_counter() - start
+    logger.info(f"Mise à jour de {base_version} avec {len(df_new)} lignes : {update_seconds:.1f}s")
+    metadata = {"base_version": base_version, "update_path": new_path, "n_new_rows": len(df_new),
+                "n_rounds": n_rounds, "update_seconds": round(update_seconds, 2)}
+
+    if compare_with is not None:
+        if eval_path:
+            df_fit, df_eval = df_new, pd.read_csv(eval_path, index_col=0)
+            incremental, compare_seconds = pipeline, update_seconds
+        else:
+            # modèles de comparaison sur 80 % des nouvelles lignes, évalués sur les 20 % restants
+            df_fit, df_eval = train_test_split(df_new, test_size=0.2, random_state=42)
+            start = time.perf_counter()
+            incremental = update_fitted_pipeline(base_pipeline, df_fit, n_rounds=n_rounds)
+            compare_seconds = time.perf_counter() - start
+        df_full = pd.concat([pd.read_csv(compare_with, index_col=0), df_fit])
+        start = time.perf_counter()
+        full = create_fitted_pipeline(df_full, pipeline=clone(full_pipeline))
+        full_seconds = time.perf_counter() - start
+        report = pd.DataFrame({"incrémental": per_label_f1(incremental, df_eval),
+                               "ré-entraînement complet": per_label_f1(full, df_eval)})
+        report["delta"] = report["incrémental"] - report["ré-entraînement complet"]
+        report.loc["moyenne"] = report.mean()
+        print(report.round(3).to_string())
+        print(f"mise à jour {compare_seconds:.1f}s, ré-entraînement complet {full_seconds:.1f}s "
+              f"({100 * compare_seconds / full_seconds:.0f}%)")
+        metadata.update({"full_retrain_seconds": round(full_seconds, 2),
+                         "f1_delta_vs_full_retrain": report["delta"].round(4).to_dict()})
+    return save_pipeline(pipeline, activate=activate, metadata=metadata)
+
+
+def load_pipeline(version=None, engine=INFERENCE_ENGINE, projected_tfidf=PROJECTED_TFIDF):
+    '''Load a fitted pipeline from the registry (the active version by default).
+    engine "compiled": the boosters are replaced by a TreeEnsemble (see CompiledPipeline).
+    projected_tfidf: tfidf + svd replaced by ProjectedTfidf (see project_text_features).
+    output: (pipeline, version)'''
+    version = version or get_active_version()
+    if version is None:
+        raise FileNotFoundError(f"Aucune version active dans {MODELS_DIR} : "
+                                "lancer `python model_registry.py train` d'abord.")
+    key = (version, engine, projected_tfidf)
+    if key not in _loaded_pipelines:
+        # ancien modèle libéré avant le chargement : jamais deux modèles en mémoire à la fois
+        _loaded_pipelines.clear()
+        pipeline = joblib.load(os.path.join(MODELS_DIR, version, PIPELINE_FILE))
+        if projected_tfidf:
+            pipeline = project_text_features(pipeline)
+        if engine == "compiled":
+            pipeline = CompiledPipeline(pipeline)
+        elif engine != "xgboost":
+            raise ValueError(f"Unknown inference engine: {engine}")
+        _loaded_pipelines[key] = pipeline
+        logger.info(f"Modèle {version} chargé (moteur {engine}, tf-idf projeté : {projected_tfidf}).")
+    return _loaded_pipelines[key], version
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Registre des modèles entraînés.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="Entraîne et enregistre une nouvelle version.")
+    train_parser.add_argument("--data", default=PATH_LABELISED_SET)
+    train_parser.add_argument("--no-activate", action="store_true",
+                              help="Ne pas basculer la prédiction sur la nouvelle version.")
+    train_parser.add_argument("--streaming", action="store_true",
+                              help="Lecture du jeu étiqueté par morceaux (jeux qui ne tiennent pas en mémoire).")
+    train_parser.add_argument("--chunk-size", type=int, default=None)
+
+    update_parser = subparsers.add_parser("update", help="Met à jour un modèle avec de nouvelles lignes étiquetées.")
+    update_parser.add_argument("--data", required=True, help="nouvelles lignes étiquetées uniquement")
+    update_parser.add_argument("--base", default=None, help="version à mettre à jour (défaut : version active)")
+    update_parser.add_argument("--rounds", type=int, default=INCREMENTAL_ROUNDS)
+    update_parser.add_argument("--no-activate", action="store_true")
+    update_parser.add_argument("--compare-with", default=None,
+                               help="jeu étiqueté de la version de base : compare avec un ré-entraînement complet")
+    update_parser.add_argument("--eval", default=None, help="jeu d'évaluation de la comparaison")
+
+    activate_parser = subparsers.add_parser("activate", help="Change la version active.")
+    activate_parser.add_argument("version")
+
+    subparsers.add_parser("list", help="Liste les versions disponibles.")
+
+    args = parser.parse_args()
+    if args.command == "train":
+        print(train_and_register(args.data, activate=not args.no_activate,
+                                 streaming=args.streaming, chunk_size=args.chunk_size))
+    elif args.command == "update":
+        print(update_and_register(args.data, args.base, args.rounds, activate=not args.no_activate,
+                                  compare_with=args.compare_with, eval_path=args.eval))
+    elif args.command == "activate":
+        set_active_version(args.version)
+    elif args.command == "list":
+        active = get_active_version()
+        for version in list_versions():
+            print(("* " if version == active else "  ") + version)
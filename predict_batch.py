@@ -1,9 +1,12 @@
 import os
+import socket
 import pandas as pd
 from dotenv import load_dotenv
 import psycopg2
 import logging
-from Utils import predict_and_correct,create_fitted_pipeline
+from Utils import (predict_and_correct, cache_stats, reset_cache_stats, dedup_stats, reset_dedup_stats,
+                   length_stats, reset_length_stats)
+from model_registry import load_pipeline
 from datetime import datetime
 
 # Charger les variables d'environnement
@@ -16,6 +19,9 @@ SUPABASE_USER = os.getenv("SUPABASE_USER")
 SUPABASE_PASSWORD = os.getenv("SUPABASE_PASSWORD")
 SUPABASE_TABLE = os.getenv("SUPABASE_TABLE")
 BATCH_SIZE = int(os.getenv("BATCH_SIZE", 5000))
+# Bail d'une ligne réservée par un worker (claimed_by / claimed_at) : passé ce délai sans prédiction
+# (worker arrêté ou planté), la ligne peut être réservée par un autre worker
+CLAIM_LEASE_SECONDS = int(os.getenv("CLAIM_LEASE_SECONDS", 900))
 
 
 # === Créer un logger spécifique au fichier ===
@@ -40,57 +46,134 @@ logger.addHandler(file_handler)
 # === Exemple d'utilisation ===
 logger.info("Démarrage du script de prédiction.")
 
-def get_prediction():
+def connect():
+    return psycopg2.connect(
+        host=SUPABASE_HOST,
+        port=SUPABASE_PORT,
+        dbname=SUPABASE_DB,
+        user=SUPABASE_USER,
+        password=SUPABASE_PASSWORD
+    )
+
+def claim_batch(conn, worker_id, batch_size=BATCH_SIZE, lease_seconds=CLAIM_LEASE_SECONDS):
+    '''Reserve up to batch_size rows without prediction for worker_id and read them.
+    Rows locked by another transaction are skipped (SKIP LOCKED), rows claimed by another worker
+    are skipped until their lease has expired: concurrent workers never get the same rows.
+    Output: DataFrame (id, title, text, rating)'''
+    query = f'''
+        UPDATE {SUPABASE_TABLE}
+        SET claimed_by = %(worker_id)s, claimed_at = now()
+        WHERE id IN (
+            SELECT id FROM {SUPABASE_TABLE}
+            WHERE has_prediction IS FALSE
+              AND (claimed_at IS NULL OR claimed_at < now() - %(lease)s * interval '1 second')
+            LIMIT %(batch_size)s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, review_title AS title, review_text AS text, rating;
+    '''
+    df = pd.read_sql_query(query, conn, params={"worker_id": worker_id, "lease": lease_seconds,
+                                                "batch_size": batch_size})
+    conn.commit()
+    return df
+
+def release_claims(conn, worker_id, ids=None):
+    '''Give back the rows claimed by worker_id that have not been predicted (only ids if given).'''
+    id_filter = " AND id = ANY(%s)" if ids is not None else ""
+    with conn.cursor() as cursor:
+        cursor.execute(f'''
+            UPDATE {SUPABASE_TABLE} SET claimed_by = NULL, claimed_at = NULL
+            WHERE claimed_by = %s AND has_prediction IS FALSE{id_filter};
+        ''', (worker_id,) if ids is None else (worker_id, pd.Index(ids).tolist()))
+        released = cursor.rowcount
+    conn.commit()
+    return released
+
+def default_worker_id():
+    '''Claim owner of this process (host and pid): unique among the workers running at the same time.'''
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def fetch_batch(conn, worker_id=None):
+    '''Next batch of reviews without prediction, claimed with claim_batch under worker_id
+    (default_worker_id() if None): rows claimed by a running worker are never read.
+    Output: DataFrame (title, text, rating) indexed by id, empty if there is nothing to predict'''
+    df = claim_batch(conn, worker_id or default_worker_id())
+    return df.set_index("id")
+
+def score_batch(df):
+    '''Predict a batch read by fetch_batch and save the predictions in predicted_data/.
+    Output: DataFrame of predictions'''
     ClASSES_ =  [
     "non_tenu", "produit_non_conforme", "mauvaise_qualite", "produit_endommage",
     "retour_client", "produit_dangereux", "aucun_probleme", "autre_probleme", "sav_saller_probleme"
 ]
-    timestamp = datetime.utcnow().strftime("%Y-%m-%d_%H-%M-%S")
+    # microsecondes : plusieurs batchs peuvent être prédits dans la même seconde
+    timestamp = datetime.utcnow().strftime("%Y-%m-%d_%H-%M-%S_%f")
+    logger.info(f"{len(df)} lignes récupérées pour prédiction.")
+    pipeline, model_version = load_pipeline()
+    logger.info(f"Modèle {model_version} chargé")
+    reset_cache_stats()
+    reset_dedup_stats()
+    reset_length_stats()
+    preds = predict_and_correct(df,pipeline)
+    logger.info(f"Cache des textes : {cache_stats()}")
+    logger.info(f"Dédoublonnage : {dedup_stats()}")
+    logger.info(f"Temps par longueur de revue : {length_stats()}")
+    preds["model_version"] = model_version
+    logger.info("Prédictions terminées.")
+    logger.info("-----------------------")
+
+    for classe in ClASSES_:
+        print(classe)
+        logger.info(f"Classe: {classe}, {preds[classe].sum()} prédictions")
+        preds[classe] = preds[classe].astype(bool)
+
+    logger.info("-----------------------")
+    preds.to_csv(f"predicted_data/predicted_batch_{timestamp}.csv")
+    logger.info(f"Prédictions enregistrées dans predicted_batch_{timestamp}.csv")
+
+    return preds
+
+def get_prediction(conn=None, worker_id=None):
+    '''Predict the next batch of reviews without prediction.
+    conn: open connection, kept open (long-lived worker); if None, a connection is opened and closed.
+    worker_id: owner of the claimed batch (default_worker_id() if None), to pass as claimed_by
+    to insert_predictions. On error, the claimed rows are given back.
+    Output: DataFrame of predictions, or None if there is nothing to predict (or on error)'''
+    own_connection = conn is None
+    worker_id = worker_id or default_worker_id()
+    df = None
     try:
-        conn = psycopg2.connect(
-            host=SUPABASE_HOST,
-            port=SUPABASE_PORT,
-            dbname=SUPABASE_DB,
-            user=SUPABASE_USER,
-            password=SUPABASE_PASSWORD
-        )
-        logger.info("Connexion à la base réussie.")
-
-        query = f'''
-            SELECT id, review_title AS title, review_text AS text, rating
-            FROM {SUPABASE_TABLE}
-            WHERE has_prediction IS FALSE
-            LIMIT {BATCH_SIZE};
-        '''
+        if own_connection:
+            conn = connect()
+            logger.info("Connexion à la base réussie.")
 
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        df = fetch_batch(conn, worker_id)
+        if own_connection:
+            conn.close()
+        else:
+            # pas de transaction laissée ouverte entre deux batchs
+            conn.rollback()
 
         if df.empty:
             logger.info("Aucune nouvelle donnée à prédire. Fin du script.")
             return None
 
-        df.set_index("id", inplace=True)
-        logger.info(f"{len(df)} lignes récupérées pour prédiction.")
-        pipeline = create_fitted_pipeline()
-        logger.info(f"Pipelne fitted")
-        preds = predict_and_correct(df,pipeline)
-        logger.info("Prédictions terminées.")
-        logger.info("-----------------------")
-        
-        for classe in ClASSES_:
-            print(classe)
-            logger.info(f"Classe: {classe}, {preds[classe].sum()} prédictions")
-            preds[classe] = preds[classe].astype(bool)
-
-        logger.info("-----------------------")
-        preds.to_csv(f"predicted_data/predicted_batch_{timestamp}.csv")
-        logger.info(f"Prédictions enregistrées dans predicted_batch_{timestamp}.csv")
-
-        return preds
+        return score_batch(df)
 
     except Exception as e:
         logger.error(f"Erreur lors de la prédiction : {e}")
+        if not own_connection and not conn.closed:
+            conn.rollback()
+        if df is not None and not df.empty:
+            # lignes rendues tout de suite, sans attendre l'expiration du bail
+            try:
+                release_conn = conn if not own_connection and not conn.closed else connect()
+                release_claims(release_conn, worker_id, df.index)
+                if release_conn is not conn:
+                    release_conn.close()
+            except Exception as e:
+                logger.error(f"Lignes non rendues (reprises à l'expiration du bail) : {e}")
         return None
 
 if __name__ == "__main__":
@@ -0,0 +1,441 @@
+import os
+import select
+import signal
+import logging
+import argparse
+import threading
+import time
+import queue
+from datetime import datetime
+from dotenv import load_dotenv
+from Utils import start_pool
+from model_registry import load_pipeline
+from predict_batch import connect, release_claims, fetch_batch, score_batch, default_worker_id
+from etl_insert import insert_predictions
+
+# Charger les variables d'environnement
+load_dotenv("config/.env")
+
+# Pause quand il n'y a rien à prédire : WORKER_IDLE_SLEEP secondes, doublée à chaque batch vide
+# jusqu'à WORKER_MAX_IDLE_SLEEP, remise à zéro dès qu'un batch est traité
+WORKER_IDLE_SLEEP = float(os.getenv("WORKER_IDLE_SLEEP", 5))
+WORKER_MAX_IDLE_SLEEP = float(os.getenv("WORKER_MAX_IDLE_SLEEP", 180))
+# Batch en erreur (prédiction ou écriture) : ses lignes sont rendues et le worker réessaie après
+# WORKER_IDLE_SLEEP secondes ; il s'arrête après WORKER_MAX_ERRORS erreurs consécutives (0 = jamais)
+WORKER_MAX_ERRORS = int(os.getenv("WORKER_MAX_ERRORS", 5))
+# Canal LISTEN/NOTIFY déclenché par le trigger d'insertion (install_notify_trigger ; vide = polling seul).
+# Une rafale de notifications est regroupée en un micro-batch : on attend que le canal reste calme
+# NOTIFY_COALESCE_WINDOW secondes, au plus NOTIFY_MAX_DELAY secondes après la première notification.
+# Sans notification, la base est quand même interrogée toutes les WORKER_MAX_IDLE_SLEEP secondes.
+NOTIFY_CHANNEL = os.getenv("NOTIFY_CHANNEL", "new_reviews")
+NOTIFY_COALESCE_WINDOW = float(os.getenv("NOTIFY_COALESCE_WINDOW", 0.5))
+NOTIFY_MAX_DELAY = float(os.getenv("NOTIFY_MAX_DELAY", 5))
+SUPABASE_TABLE = os.getenv("SUPABASE_TABLE")
+# Mode pipeline (--pipelined) : nombre de batchs en attente entre la lecture et la prédiction,
+# et entre la prédiction et l'écriture ; une étape en avance se bloque quand sa file est pleine
+# (la lecture avant de réserver les lignes : un batch en attente ne consomme pas son bail)
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 1))
+
+
+# === Créer un logger spécifique au fichier ===
+logger = logging.getLogger("prediction_worker")
+logger.setLevel(logging.INFO)
+
+# === Créer un handler avec fichier unique ===
+log_filename = f"logs/prediction_worker_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+file_handler = logging.FileHandler(log_filename)
+file_handler.setLevel(logging.INFO)
+
+# === Ajouter un formatteur propre ===
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+file_handler.setFormatter(formatter)
+
+# === Nettoyer anciens handlers pour éviter les doublons ===
+if logger.hasHandlers():
+    logger.handlers.clear()
+
+logger.addHandler(file_handler)
+
+
+def install_notify_trigger(conn, table=SUPABASE_TABLE, channel=NOTIFY_CHANNEL):
+    '''Create (or replace) the trigger that notifies channel after each INSERT statement on table.
+    One notification per statement, not per row: a bulk insert wakes the worker once.'''
+    name = f"{table.split('.')[-1]}_notify"
+    with conn.cursor() as cursor:
+        cursor.execute(f'''
+            CREATE OR REPLACE FUNCTION {name}() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                PERFORM pg_notify('{channel}', '');
+                RETURN NULL;
+            END $$;
+            DROP TRIGGER IF EXISTS {name} ON {table};
+            CREATE TRIGGER {name} AFTER INSERT ON {table}
+                FOR EACH STATEMENT EXECUTE FUNCTION {name}();
+        ''')
+    conn.commit()
+    logger.info(f"Trigger {name} installé sur {table} (canal {channel}).")
+
+
+class PredictionWorker:
+    """Long-lived prediction loop: the model (load_pipeline cache), spaCy and the database
+    connection are loaded once and reused by every batch. Batches are processed back-to-back
+    while there is work. When the queue is empty, the worker waits for a notification on
+    channel (insert trigger), groups a burst of notifications into one micro-batch, and polls
+    the table every max_idle_sleep seconds as a safety net. Without LISTEN (channel empty,
+    or not supported by the connection, e.g. a transaction pooler) it polls with exponential backoff.
+    Each batch is claimed under worker_id (claim_batch): any number of workers, on any number of
+    machines, can drain the table in parallel without scoring the same rows.
+    A batch in error is given back and retried after idle_sleep seconds, never taken for an empty
+    queue; the worker stops after max_errors consecutive errors.
+    SIGTERM / SIGINT stop the loop after the batch in flight has been written."""
+    def __init__(self, idle_sleep=WORKER_IDLE_SLEEP, max_idle_sleep=WORKER_MAX_IDLE_SLEEP, exit_when_empty=False,
+                 channel=NOTIFY_CHANNEL, max_errors=WORKER_MAX_ERRORS):
+        self.idle_sleep = idle_sleep
+        self.max_idle_sleep = max_idle_sleep
+        self.exit_when_empty = exit_when_empty
+        self.max_errors = max_errors
+        self.channel = channel
+        self.worker_id = default_worker_id()
+        self.stop_event = threading.Event()
+        self.conn = None
+        self.listen_conn = None
+        # self-pipe : un signal d'arrêt réveille le select() de _wait
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_write, False)
+
+    def request_stop(self, signum=None, frame=None):
+        logger.info(f"Signal {signum} reçu : arrêt après le batch en cours.")
+        self.stop_event.set()
+        try:
+            os.write(self._wakeup_write, b"\0")
+        except BlockingIOError:
+            pass
+
+    def connection(self):
+        # reconnexion si la connexion a été fermée (erreur réseau, redémarrage de la base)
+        if self.conn is None or self.conn.closed:
+            self.conn = connect()
+            logger.info("Connexion à la base ouverte.")
+        return self.conn
+
+    def listen(self):
+        '''Open the LISTEN connection if needed. Output: True if the worker is listening'''
+        if not self.channel:
+            return False
+        if self.listen_conn is None or self.listen_conn.closed:
+            try:
+                self.listen_conn = connect()
+                self.listen_conn.autocommit = True
+                with self.listen_conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel};")
+                logger.info(f"En écoute sur le canal {self.channel}.")
+            except Exception as e:
+                logger.error(f"LISTEN impossible, polling seul : {e}")
+                self._close_listen()
+                return False
+        return True
+
+    def _close_listen(self):
+        if self.listen_conn is not None and not self.listen_conn.closed:
+            self.listen_conn.close()
+        self.listen_conn = None
+
+    def _drain(self):
+        '''Read and discard the pending notifications. Output: True if there was at least one'''
+        if self.listen_conn is None:
+            return False
+        try:
+            self.listen_conn.poll()
+        except Exception as e:
+            logger.error(f"Connexion LISTEN perdue : {e}")
+            self._close_listen()
+            return False
+        notified = bool(self.listen_conn.notifies)
+        self.listen_conn.notifies.clear()
+        return notified
+
+    def _wait(self, timeout):
+        '''Sleep until timeout, a notification or a stop request. Output: True if notified'''
+        sources = [self._wakeup_read] + ([self.listen_conn] if self.listen_conn is not None else [])
+        ready, _, _ = select.select(sources, [], [], max(timeout, 0))
+        return self.listen_conn in ready and self._drain()
+
+    def _coalesce(self):
+        '''Wait for the end of a burst of notifications (quiet for NOTIFY_COALESCE_WINDOW
+        seconds, at most NOTIFY_MAX_DELAY seconds), so that it is predicted as one micro-batch.'''
+        deadline = time.monotonic() + NOTIFY_MAX_DELAY
+        n_notifications = 1
+        while not self.stop_event.is_set() and time.monotonic() < deadline:
+            if not self._wait(min(NOTIFY_COALESCE_WINDOW, deadline - time.monotonic())):
+                break
+            n_notifications += 1
+        logger.info(f"{n_notifications} notification(s) regroupée(s).")
+
+    def release(self, ids=None):
+        '''Give back the rows claimed and not written (batch in error; only ids if given),
+        without waiting for the lease.'''
+        try:
+            released = release_claims(self.connection(), self.worker_id, ids)
+            if released:
+                logger.info(f"{released} lignes rendues.")
+        except Exception as e:
+            logger.error(f"Lignes non rendues (reprises à l'expiration du bail) : {e}")
+
+    def close(self):
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = None
+        self._close_listen()
+
+    def run_once(self):
+        '''Claim, predict and write one batch. Output: number of rows written, 0 if there is nothing to predict.
+        If the batch cannot be predicted or written, its rows are given back and the error is raised.'''
+        # les notifications déjà reçues concernent des lignes que ce batch va lire
+        self._drain()
+        df = fetch_batch(self.connection(), self.worker_id)
+        if df.empty:
+            return 0
+        try:
+            preds = score_batch(df)
+            written = insert_predictions(preds, self.connection(), close_connection=False, claimed_by=self.worker_id)
+        except Exception:
+            self.release(df.index)
+            raise
+        if not written:
+            self.release(df.index)
+            raise RuntimeError(f"aucune des {len(df)} prédictions n'a été écrite")
+        return written
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        logger.info(f"Démarrage du worker de prédiction {self.worker_id}.")
+        sleep, n_batches, n_rows, n_errors = self.idle_sleep, 0, 0, 0
+        while not self.stop_event.is_set():
+            start = time.perf_counter()
+            try:
+                written = self.run_once()
+            except Exception as e:
+                n_errors += 1
+                logger.error(f"Erreur du batch ({n_errors} consécutive(s)) : {e}")
+                self.close()
+                if self.max_errors and n_errors >= self.max_errors:
+                    logger.error(f"{n_errors} erreurs consécutives, arrêt du worker.")
+                    break
+                # la file n'est pas vide : nouvel essai après une courte pause, sans backoff
+                self._wait(self.idle_sleep)
+                continue
+            n_errors = 0
+            if written:
+                n_batches += 1
+                n_rows += written
+                logger.info(f"Batch {n_batches} : {written} lignes en {time.perf_counter() - start:.1f}s")
+                sleep = self.idle_sleep
+                continue
+            if self.exit_when_empty:
+                logger.info("Plus rien à prédire, arrêt du worker.")
+                break
+            if self.listen():
+                logger.info("Rien à prédire, en attente de notification.")
+                if self._wait(self.max_idle_sleep):
+                    self._coalesce()
+                continue
+            logger.info(f"Rien à prédire, pause de {sleep:.0f}s.")
+            # réveillé tout de suite par un signal d'arrêt
+            self._wait(sleep)
+            sleep = min(2 * sleep, self.max_idle_sleep)
+        self.close()
+        logger.info(f"Worker arrêté : {n_batches} batchs, {n_rows} lignes.")
+
+
+class StageStats:
+    """Counters of a stage of PipelinedWorker: batches, rows, time spent working (utilisation),
+    blocked on a full output queue (backpressure) and waiting on an empty input queue (starved)."""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.batches = 0
+        self.rows = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.starved = 0.0
+
+    def put(self, output_queue, item):
+        start = time.perf_counter()
+        output_queue.put(item)
+        self.blocked += time.perf_counter() - start
+
+    def get(self, input_queue):
+        start = time.perf_counter()
+        item = input_queue.get()
+        self.starved += time.perf_counter() - start
+        return item
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        return {"batches": self.batches, "rows": self.rows,
+                "utilisation": round(self.busy / elapsed, 3),
+                "backpressure": round(self.blocked / elapsed, 3),
+                "starved": round(self.starved / elapsed, 3)}
+
+
+class PipelinedWorker(PredictionWorker):
+    """PredictionWorker with overlapping stages: a reader thread claims batch N+1 and a writer
+    thread writes batch N-1 (each with its own connection) while the main thread scores batch N.
+    The stages are linked by queues of queue_size batches. The reader takes a slot (semaphore of
+    queue_size, given back when the scorer takes the batch) before claiming: when scoring is the
+    bottleneck it blocks without holding rows, so no claimed batch waits more than one scoring
+    while its lease runs (backpressure).
+    Scoring stays in one thread driving the process pool of predict_and_correct (PREDICT_N_JOBS):
+    threads would share the GIL. The pool is started before the reader and writer threads, so that
+    its processes are forked from a single-threaded process (see get_pool).
+    A stop request lets the batches already claimed go through."""
+    def __init__(self, queue_size=PIPELINE_QUEUE_SIZE, **kwargs):
+        super().__init__(**kwargs)
+        self.to_score = queue.Queue(maxsize=queue_size)
+        self.score_slots = threading.Semaphore(queue_size)
+        self.to_write = queue.Queue(maxsize=queue_size)
+        self.write_conn = None
+        self.stats = {}
+
+    def write_connection(self):
+        if self.write_conn is None or self.write_conn.closed:
+            self.write_conn = connect()
+        return self.write_conn
+
+    def stage_report(self):
+        return {name: stats.report() for name, stats in self.stats.items()}
+
+    def _take_slot(self, stats):
+        '''Wait for room in to_score before claiming. Output: False if the worker is stopping'''
+        start = time.perf_counter()
+        taken = False
+        while not taken and not self.stop_event.is_set():
+            taken = self.score_slots.acquire(timeout=0.5)
+        stats.blocked += time.perf_counter() - start
+        return taken
+
+    def _read(self):
+        stats = self.stats["lecture"]
+        sleep, n_errors = self.idle_sleep, 0
+        while not self.stop_event.is_set() and self._take_slot(stats):
+            start = time.perf_counter()
+            try:
+                self._drain()
+                df = fetch_batch(self.connection(), self.worker_id)
+            except Exception as e:
+                df = None
+                n_errors += 1
+                logger.error(f"Erreur de lecture ({n_errors} consécutive(s)) : {e}")
+                self.close()
+            stats.busy += time.perf_counter() - start
+            if df is not None and len(df):
+                n_errors = 0
+                stats.batches += 1
+                stats.rows += len(df)
+                # place réservée par _take_slot : ne bloque pas
+                stats.put(self.to_score, df)
+                sleep = self.idle_sleep
+                continue
+            self.score_slots.release()
+            if df is None:
+                if self.max_errors and n_errors >= self.max_errors:
+                    logger.error(f"{n_errors} erreurs de lecture consécutives, arrêt de la lecture.")
+                    break
+                # la file n'est pas forcément vide : nouvel essai après une courte pause
+                self._wait(self.idle_sleep)
+                continue
+            n_errors = 0
+            if self.exit_when_empty:
+                logger.info("Plus rien à prédire, arrêt de la lecture.")
+                break
+            if self.listen():
+                if self._wait(self.max_idle_sleep):
+                    self._coalesce()
+                continue
+            self._wait(sleep)
+            sleep = min(2 * sleep, self.max_idle_sleep)
+        stats.put(self.to_score, None)
+
+    def _score(self):
+        stats = self.stats["prédiction"]
+        while True:
+            df = stats.get(self.to_score)
+            if df is None:
+                break
+            self.score_slots.release()
+            start = time.perf_counter()
+            try:
+                preds = score_batch(df)
+            except Exception as e:
+                logger.error(f"Erreur de prédiction : {e}")
+                preds = None
+            stats.busy += time.perf_counter() - start
+            stats.batches += 1
+            stats.rows += len(df)
+            stats.put(self.to_write, (df.index, preds))
+        stats.put(self.to_write, None)
+
+    def _write(self):
+        stats = self.stats["écriture"]
+        while True:
+            item = stats.get(self.to_write)
+            if item is None:
+                break
+            ids, preds = item
+            start = time.perf_counter()
+            written = 0
+            try:
+                if preds is not None:
+                    written = insert_predictions(preds, self.write_connection(), close_connection=False,
+                                                 claimed_by=self.worker_id)
+                if not written:
+                    # batch en erreur : ses lignes sont rendues tout de suite, sans attendre le bail
+                    release_claims(self.write_connection(), self.worker_id, ids)
+            except Exception as e:
+                logger.error(f"Erreur d'écriture (lignes reprises à l'expiration du bail) : {e}")
+                if self.write_conn is not None and not self.write_conn.closed:
+                    self.write_conn.close()
+            stats.busy += time.perf_counter() - start
+            stats.batches += 1
+            stats.rows += written
+            logger.info(f"Batch écrit : {written}/{len(ids)} lignes. Étapes : {self.stage_report()}")
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        logger.info(f"Démarrage du worker de prédiction {self.worker_id} (pipeline).")
+        try:
+            pipeline, model_version = load_pipeline()
+            start_pool(pipeline)
+        except Exception as e:
+            # le pool sera créé au premier batch, sans fork (threads déjà démarrés)
+            logger.error(f"Pool de prédiction non démarré : {e}")
+        self.stats = {name: StageStats() for name in ("lecture", "prédiction", "écriture")}
+        reader = threading.Thread(target=self._read, name="lecture")
+        writer = threading.Thread(target=self._write, name="écriture")
+        reader.start()
+        writer.start()
+        self._score()
+        reader.join()
+        writer.join()
+        self.close()
+        if self.write_conn is not None and not self.write_conn.closed:
+            self.write_conn.close()
+        logger.info(f"Worker arrêté. Étapes : {self.stage_report()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker de prédiction en continu.")
+    parser.add_argument("--exit-when-empty", action="store_true", help="s'arrêter quand il n'y a plus rien à prédire")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="lecture, prédiction et écriture en parallèle (PipelinedWorker)")
+    parser.add_argument("--install-trigger", action="store_true",
+                        help=f"créer le trigger NOTIFY sur {SUPABASE_TABLE} puis quitter")
+    args = parser.parse_args()
+    if args.install_trigger:
+        conn = connect()
+        install_notify_trigger(conn)
+        conn.close()
+    else:
+        worker_class = PipelinedWorker if args.pipelined else PredictionWorker
+        worker_class(exit_when_empty=args.exit_when_empty).run()
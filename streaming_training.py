@@ -0,0 +1,151 @@
+import os
+import random
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import xgboost as xgb
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+import Utils as ut
+
+# Entraînement out-of-core : le jeu étiqueté est lu par morceaux de TRAIN_CHUNK_SIZE lignes,
+# la SVD est apprise sur un échantillon de SVD_SAMPLE_SIZE revues au plus, et les boosters
+# sur une DMatrix en mémoire externe (features écrites sur disque morceau par morceau).
+TRAIN_CHUNK_SIZE = int(os.getenv("TRAIN_CHUNK_SIZE", 10000))
+SVD_SAMPLE_SIZE = int(os.getenv("SVD_SAMPLE_SIZE", 20000))
+
+logger = logging.getLogger("streaming_training")
+
+
+def read_labeled_chunks(path, chunk_size=TRAIN_CHUNK_SIZE):
+    '''Cleaned chunks (Preprocessor) of the labeled set.'''
+    for chunk in pd.read_csv(path, index_col=0, chunksize=chunk_size):
+        chunk = ut.Preprocessor().transform(chunk)
+        if len(chunk):
+            yield chunk
+
+
+class StreamingFeatures(BaseEstimator, TransformerMixin):
+    """Same features as final_features (20 SVD components of the hashed tf-idf, then the
+    scaled hand-made features), fitted chunk by chunk with partial_fit then finalize:
+    document frequencies and scaler statistics are accumulated over all the chunks,
+    the SVD is fitted on a reservoir sample of sample_size reviews.
+    input: DataFrame with the columns revue and rating. Output: float32 array"""
+    def __init__(self, sample_size=SVD_SAMPLE_SIZE, random_state=42):
+        self.sample_size = sample_size
+        self.random_state = random_state
+
+    def _start(self):
+        self.text_pipeline_ = ut.build_text_pipeline("hashing")
+        self.numeric_pipeline_ = Pipeline([
+            ('features', ut.NumericFeatures(sentiment=ut.SENTIMENT_BACKEND)),
+            ('scaler', StandardScaler())
+        ])
+        self.document_frequency_ = np.zeros(ut.HASHING_N_FEATURES, dtype=np.int64)
+        self.n_documents_ = 0
+        self._sample = []
+        self._rng = random.Random(self.random_state)
+
+    def _hashed(self, col):
+        steps = self.text_pipeline_.named_steps
+        return steps["hashing"].transform(steps["preprocess"].transform(col))
+
+    def partial_fit(self, X, y=None):
+        if not hasattr(self, "text_pipeline_"):
+            self._start()
+        counts = self._hashed(X["revue"]).tocsr()
+        counts.sum_duplicates()
+        self.document_frequency_ += np.bincount(counts.indices, minlength=counts.shape[1])
+        # échantillon réservoir : chaque revue a la même probabilité d'être gardée pour la SVD
+        for row in range(counts.shape[0]):
+            if self.n_documents_ < self.sample_size:
+                self._sample.append(counts[row])
+            else:
+                slot = self._rng.randint(0, self.n_documents_)
+                if slot < self.sample_size:
+                    self._sample[slot] = counts[row]
+            self.n_documents_ += 1
+        steps = self.numeric_pipeline_.named_steps
+        steps["scaler"].partial_fit(steps["features"].transform(X[["revue", "rating"]]))
+        return self
+
+    def finalize(self):
+        '''idf from the accumulated document frequencies (same formula as TfidfTransformer),
+        then SVD fitted on the sample.'''
+        tfidf = self.text_pipeline_.named_steps["tfidf"]
+        n_documents = self.n_documents_ + int(tfidf.smooth_idf)
+        document_frequency = self.document_frequency_ + int(tfidf.smooth_idf)
+        tfidf.idf_ = (np.log(n_documents / document_frequency) + 1).astype(np.float32)
+        tfidf.n_features_in_ = len(document_frequency)
+        self.text_pipeline_.named_steps["svd"].fit(tfidf.transform(sp.vstack(self._sample)))
+        del self._sample, self._rng
+        return self
+
+    def fit(self, X, y=None):
+        return self.partial_fit(X).finalize()
+
+    def transform(self, X):
+        return np.hstack([self.text_pipeline_.transform(X["revue"]),
+                          self.numeric_pipeline_.transform(X[["revue", "rating"]])]).astype(np.float32)
+
+
+class _FeatureChunks(xgb.DataIter):
+    """Feature chunks saved as .npy files, read one at a time by XGBoost."""
+    def __init__(self, files, cache_prefix):
+        self.files = files
+        self.position = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self.position == len(self.files):
+            return False
+        input_data(data=np.load(self.files[self.position]))
+        self.position += 1
+        return True
+
+    def reset(self):
+        self.position = 0
+
+
+def fit_streaming_model(features_iter, y, template=ut.model):
+    '''Fit one booster per label on an external-memory DMatrix, with the parameters of
+    the XGBClassifier of template, and wrap them in a fitted MultiOutputClassifier.'''
+    estimator = template.estimator
+    params = ut.booster_params(estimator)
+    dtrain = xgb.ExtMemQuantileDMatrix(features_iter)
+    estimators = []
+    for label in range(y.shape[1]):
+        dtrain.set_label(y[:, label])
+        booster = xgb.train(params, dtrain, num_boost_round=estimator.n_estimators)
+        estimators.append(ut.classifier_from_booster(booster, estimator))
+        logger.info(f"Label {ut.LABEL_COLUMNS[label]} entraîné.")
+    model = clone(template)
+    model.estimators_ = estimators
+    return model
+
+
+def create_fitted_pipeline_streaming(path=ut.PATH_LABELISED_SET, chunk_size=TRAIN_CHUNK_SIZE):
+    '''Out-of-core version of create_fitted_pipeline: two passes over the labeled set,
+    read by chunks (features, then boosters on features written to a temporary directory).
+    Memory depends on chunk_size and SVD_SAMPLE_SIZE, not on the size of the labeled set
+    (apart from the label matrix, 9 bytes per review).'''
+    features = StreamingFeatures()
+    n_rows = 0
+    for chunk in read_labeled_chunks(path, chunk_size):
+        features.partial_fit(chunk[["revue", "rating"]])
+        n_rows += len(chunk)
+        logger.info(f"Passe 1 : {n_rows} lignes")
+    features.finalize()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        files, labels = [], []
+        for i, chunk in enumerate(read_labeled_chunks(path, chunk_size)):
+            files.append(os.path.join(work_dir, f"features_{i}.npy"))
+            np.save(files[-1], features.transform(chunk[["revue", "rating"]]))
+            labels.append(chunk[ut.LABEL_COLUMNS].to_numpy(dtype=np.uint8))
+            logger.info(f"Passe 2 : morceau {i} écrit")
+        model = fit_streaming_model(_FeatureChunks(files, os.path.join(work_dir, "cache")), np.vstack(labels))
+    return Pipeline(steps=[('features', features), ('model', model)])
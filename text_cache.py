@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import hashlib
+from collections import OrderedDict
+
+# Valeur absente du cache (None peut être une valeur calculée)
+_MISSING = object()
+# Nombre maximal de paramètres d'une requête SQLite
+_SQLITE_CHUNK = 500
+
+
+class TextCache:
+    """Memo cache of a function of a text (lemmatization, sentiment...).
+    Entries are keyed by a hash of the text and of the version of the function:
+    changing the version invalidates the old entries.
+    Two tiers: an in-process LRU dict of max_size entries, then an optional SQLite
+    table (path) shared between processes and runs. The table keeps the max_disk_size most
+    recently written entries, and the entries of other versions are deleted when it is opened.
+    Hits and misses are counted."""
+    def __init__(self, name, version, max_size=100000, path=None, max_disk_size=1000000):
+        self.name = name
+        self.version = version
+        self.max_size = max_size
+        self.path = path
+        self.max_disk_size = max_disk_size
+        self.memory = OrderedDict()
+        self._connection = None
+        self._connection_pid = None
+        self._disk_count = 0
+        self.reset_stats()
+
+    def key(self, text):
+        return hashlib.blake2b(f"{self.version}\x00{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+    # ==== SQLite tier ====
+    def _connect(self):
+        # une connexion par process (les connexions SQLite ne survivent pas à un fork)
+        if self._connection is None or self._connection_pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                columns = [row[1] for row in connection.execute(f"PRAGMA table_info({self.name})")]
+                if columns and "version" not in columns:
+                    # table d'un ancien format, sans version : entrées impossibles à trier, on repart de zéro
+                    connection.execute(f"DROP TABLE {self.name}")
+                connection.execute(f"CREATE TABLE IF NOT EXISTS {self.name} "
+                                   f"(key TEXT PRIMARY KEY, value, version TEXT)")
+                # les entrées des autres versions ne seront plus jamais lues
+                connection.execute(f"DELETE FROM {self.name} WHERE version IS NOT ?", (self.version,))
+            self._disk_count = connection.execute(f"SELECT COUNT(*) FROM {self.name}").fetchone()[0]
+            self._connection = connection
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def _disk_get(self, keys):
+        found = {}
+        if not self.path or not keys:
+            return found
+        connection = self._connect()
+        for start in range(0, len(keys), _SQLITE_CHUNK):
+            chunk = keys[start:start + _SQLITE_CHUNK]
+            rows = connection.execute(
+                f"SELECT key, value FROM {self.name} WHERE key IN ({', '.join('?' * len(chunk))})", chunk)
+            found.update(rows)
+        return found
+
+    def _disk_set(self, items):
+        if not self.path or not items:
+            return
+        connection = self._connect()
+        with connection:
+            connection.executemany(f"INSERT OR REPLACE INTO {self.name} (key, value, version) VALUES (?, ?, ?)",
+                                   [(key, value, self.version) for key, value in items])
+            self._disk_count += len(items)
+            # compte approché (autres process) : purge par paquets de 10 % au-delà de max_disk_size
+            if self._disk_count > self.max_disk_size * 1.1:
+                # INSERT OR REPLACE donne un nouveau rowid : les plus petits rowid sont les plus anciens
+                connection.execute(f"DELETE FROM {self.name} WHERE rowid IN (SELECT rowid FROM {self.name} "
+                                   f"ORDER BY rowid DESC LIMIT -1 OFFSET ?)", (self.max_disk_size,))
+                self._disk_count = connection.execute(f"SELECT COUNT(*) FROM {self.name}").fetchone()[0]
+
+    # ==== Memory tier ====
+    def _memory_set(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def get_many(self, texts, compute):
+        '''input: list of texts, and compute(list of texts) -> list of values for the texts not cached.
+        Output: list of values (one per text)'''
+        keys = [self.key(text) for text in texts]
+        values = [_MISSING] * len(texts)
+        for i, key in enumerate(keys):
+            value = self.memory.get(key, _MISSING)
+            if value is not _MISSING:
+                self.memory.move_to_end(key)
+                values[i] = value
+                self.hits_memory += 1
+
+        missing = [i for i, value in enumerate(values) if value is _MISSING]
+        on_disk = self._disk_get(list({keys[i] for i in missing}))
+        for i in missing:
+            if keys[i] in on_disk:
+                values[i] = on_disk[keys[i]]
+                self._memory_set(keys[i], values[i])
+                self.hits_disk += 1
+
+        # chaque texte absent n'est calculé qu'une fois, même s'il apparaît plusieurs fois
+        to_compute = {}
+        for i, value in enumerate(values):
+            if value is _MISSING:
+                to_compute.setdefault(keys[i], texts[i])
+        self.misses += len(to_compute)
+        if to_compute:
+            computed = dict(zip(to_compute, compute(list(to_compute.values()))))
+            for key, value in computed.items():
+                self._memory_set(key, value)
+            self._disk_set(list(computed.items()))
+            values = [computed[key] if value is _MISSING else value for key, value in zip(keys, values)]
+        return values
+
+    def get(self, text, compute_one):
+        return self.get_many([text], lambda texts: [compute_one(t) for t in texts])[0]
+
+    def stats(self):
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {"hits_memory": self.hits_memory, "hits_disk": self.hits_disk, "misses": self.misses,
+                "hit_rate": round((self.hits_memory + self.hits_disk) / lookups, 3) if lookups else None}
+
+    def add_stats(self, stats):
+        '''Add the counters of another process (stats() output of a worker).'''
+        self.hits_memory += stats["hits_memory"]
+        self.hits_disk += stats["hits_disk"]
+        self.misses += stats["misses"]
+
+    def reset_stats(self):
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
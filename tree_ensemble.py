@@ -0,0 +1,61 @@
+import json
+import numpy as np
+import xgboost as xgb
+
+
+class TreeEnsemble:
+    """The binary:logistic XGBoost boosters of a MultiOutputClassifier merged into a single
+    multi-target booster: the trees of all the labels are stored in one model (tree_info gives
+    the label of each tree, base_score one value per label), so that a batch is converted once
+    and all the labels are scored in a single traversal.
+    The trees and their order per label are unchanged: margins, probabilities and predict(X)
+    are the same as with model.predict(X)."""
+    def __init__(self, boosters, n_jobs=1):
+        models = [json.loads(booster.save_raw(raw_format="json")) for booster in boosters]
+        for model in models:
+            objective = model["learner"]["objective"]["name"]
+            if objective != "binary:logistic":
+                raise ValueError(f"Unsupported objective: {objective}")
+        label_trees = [model["learner"]["gradient_booster"]["model"]["trees"] for model in models]
+        if len({len(trees) for trees in label_trees}) != 1:
+            raise ValueError("All the label models must have the same number of trees")
+        self.n_labels = len(models)
+        self.n_trees = len(label_trees[0])
+
+        # arbres rangés par itération puis par label, comme un booster multi-target natif
+        trees, tree_info = [], []
+        for iteration in range(self.n_trees):
+            for label in range(self.n_labels):
+                tree = dict(label_trees[label][iteration], id=len(trees))
+                trees.append(tree)
+                tree_info.append(label)
+
+        merged = models[0]
+        learner_param = merged["learner"]["learner_model_param"]
+        learner_param["num_target"] = str(self.n_labels)
+        learner_param["base_score"] = "[" + ",".join(
+            model["learner"]["learner_model_param"]["base_score"].strip("[]") for model in models) + "]"
+        gbtree = merged["learner"]["gradient_booster"]["model"]
+        gbtree["trees"] = trees
+        gbtree["tree_info"] = tree_info
+        gbtree["gbtree_model_param"]["num_trees"] = str(len(trees))
+        gbtree["iteration_indptr"] = list(range(0, len(trees) + 1, self.n_labels))
+
+        self.booster = xgb.Booster()
+        self.booster.load_model(bytearray(json.dumps(merged).encode("utf-8")))
+        self.booster.set_param({"nthread": n_jobs})
+
+    @classmethod
+    def from_multioutput(cls, model, n_jobs=1):
+        return cls([estimator.get_booster() for estimator in model.estimators_], n_jobs=n_jobs)
+
+    def predict_margin(self, X):
+        '''input: feature matrix. Output: float32 margins (n_rows, n_labels)'''
+        return self.booster.inplace_predict(np.asarray(X, dtype=np.float32), predict_type="margin")
+
+    def predict_proba(self, X):
+        '''Output: float32 probability of each label (n_rows, n_labels)'''
+        return self.booster.inplace_predict(np.asarray(X, dtype=np.float32), predict_type="value")
+
+    def predict(self, X):
+        return (self.predict_proba(X) > 0.5).astype(np.int64)